@@ -0,0 +1,74 @@
+# Compares the single pass extractor against the old three css selector scans
+# Usage: python benchmarks/extractorBench.py [page.html ...]
+# Without arguments, synthetic pages of a few sizes are generated. Saved pages from an archive
+# make for the most realistic numbers
+import io
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from parsel import Selector
+import extractor
+
+def makePage(elements):
+	rand = random.Random(elements)
+	parts = ["<html><head><style>body { background: url('/img/bg.png') } @import \"/css/extra.css\";</style>",
+		"<link rel=\"preload\" href=\"/fonts/a.woff2\" as=\"font\"><link rel=\"stylesheet\" href=\"/css/site.css\"></head><body>"]
+	for i in range(elements):
+		choice = rand.randint(0, 5)
+		if choice == 0:
+			parts.append("<p>Paragraph "+str(i)+" with <a href=\"/page/"+str(i)+"\">a link</a> and some text to make it look like a real page.</p>")
+		elif choice == 1:
+			parts.append("<img src=\"/img/"+str(i)+".jpg\" srcset=\"/img/"+str(i)+"-2x.jpg 2x, /img/"+str(i)+"-3x.jpg 3x\">")
+		elif choice == 2:
+			parts.append("<picture><source srcset=\"/img/"+str(i)+".webp\" type=\"image/webp\"><img src=\"/img/"+str(i)+".png\"></picture>")
+		elif choice == 3:
+			parts.append("<div style=\"background-image: url(/img/tile"+str(i)+".gif)\"><span>Tile</span></div>")
+		elif choice == 4:
+			parts.append("<table background=\"/img/table"+str(i)+".png\"><tr><td>cell</td><td>cell</td></tr></table>")
+		else:
+			parts.append("<ul><li><a href=\"/cat/"+str(i)+"\">Category</a></li><li>Item</li></ul>")
+	parts.append("</body></html>")
+	return "".join(parts)
+
+def oldExtract(selector):
+	found = []
+	found += selector.css('*::attr(src)').getall()
+	found += selector.css('*::attr(href)').getall()
+	found += selector.css('*::attr(background)').getall()
+	return found
+
+def best(fn, repeat=3):
+	times = []
+	for _ in range(repeat):
+		t = time.perf_counter()
+		result = fn()
+		times.append(time.perf_counter()-t)
+	return min(times), result
+
+def bench(label, html):
+	parseTime, selector = best(lambda: Selector(text=html))
+	oldTime, old = best(lambda: oldExtract(selector))
+	newTime, new = best(lambda: extractor.extractResources(selector.root))
+	streamTime, streamed = best(lambda: list(extractor.streamResources(io.StringIO(html))))
+
+	print(label.ljust(24)+("%.1f" % (len(html)/1e6)).rjust(8)+("%.1f" % (parseTime*1000)).rjust(10)
+		+("%.1f" % (oldTime*1000)).rjust(10)+str(len(old)).rjust(8)
+		+("%.1f" % (newTime*1000)).rjust(10)+str(len(new)).rjust(8)
+		+("%.1f" % (streamTime*1000)).rjust(10)+str(len(streamed)).rjust(8))
+
+def main():
+	print("page".ljust(24)+"MB".rjust(8)+"parse ms".rjust(10)+"3xcss ms".rjust(10)+"found".rjust(8)+"walk ms".rjust(10)+"found".rjust(8)+"stream ms".rjust(10)+"found".rjust(8))
+	if len(sys.argv) > 1:
+		for path in sys.argv[1:]:
+			with open(path, "r", encoding="utf8", errors="ignore") as f:
+				bench(os.path.basename(path)[:23], f.read())
+	else:
+		for elements in (1000, 10000, 100000):
+			bench("synthetic "+str(elements), makePage(elements))
+	print("\nparse: building the parsel tree, needed by both the css scans and the tree walk")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,90 @@
+# Counts the filesystem calls made to save pages and media of a synthetic site, with the old
+# uncached folder creation and path checks against fsCache
+# Usage: python benchmarks/fsCacheBench.py [resources]
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import pathUtils
+from fsCache import FsCache
+
+# Wraps the os functions both versions use, to count the calls that reach the kernel
+COUNTED = ("mkdir", "stat", "lstat", "access", "remove")
+calls = {}
+
+def countCalls():
+	resetCalls()
+	for name in COUNTED:
+		original = getattr(os, name)
+		def counted(*args, _name=name, _original=original, **kw):
+			calls[_name] += 1
+			return _original(*args, **kw)
+		setattr(os, name, counted)
+
+def resetCalls():
+	for name in COUNTED:
+		calls[name] = 0
+
+# The createSubdirs this replaced
+def oldCreateSubdirs(base, subdirs):
+	if len(subdirs) != 0:
+		for idx in range(0, len(subdirs)):
+			subdirs[idx] = subdirs[idx].split(":")[0]
+
+		for idx in range(0, len(subdirs)):
+			direc = os.path.join(base, *subdirs[:(idx+1)])
+			if os.path.exists(direc) and not os.path.isdir(direc):
+				os.remove(direc)
+
+			if not os.path.isdir(direc):
+				os.mkdir(direc)
+
+# Every page and media file is saved under a few levels of folders, and checked a few times
+# on the way (parse_page, the local copy check and the media filter)
+def makeResources(count):
+	rand = random.Random(count)
+	resources = []
+	for i in range(count):
+		depth = rand.randint(1, 6)
+		subdirs = ["example.com"]+["section"+str(rand.randint(0, 20)) for _ in range(depth)]
+		resources.append((subdirs, "file"+str(i)+".html"))
+	return resources
+
+def run(label, base, resources, createSubdirs, pathOk):
+	resetCalls()
+	start = time.perf_counter()
+	for subdirs, page in resources:
+		createSubdirs(base, list(subdirs))
+		filepath = os.path.join(base, *subdirs, page)
+		for _ in range(3):
+			pathOk(filepath)
+	elapsed = time.perf_counter()-start
+
+	total = sum(calls.values())
+	print(label.ljust(10)+("%.1f" % (elapsed*1000)).rjust(10)+str(total).rjust(10)+("%.1f" % (total/len(resources))).rjust(14)
+		+"".join(str(calls[name]).rjust(8) for name in COUNTED))
+
+def main():
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+	resources = makeResources(count)
+	countCalls()
+
+	print(str(count)+" resources")
+	print("version".ljust(10)+"ms".rjust(10)+"syscalls".rjust(10)+"per resource".rjust(14)+"".join(name.rjust(8) for name in COUNTED))
+	for label in ("old", "fsCache"):
+		base = tempfile.mkdtemp()
+		try:
+			if label == "old":
+				run(label, base, resources, oldCreateSubdirs, pathUtils.is_path_exists_or_creatable)
+			else:
+				cache = FsCache()
+				run(label, base, resources, cache.ensure_dir, cache.path_ok)
+		finally:
+			shutil.rmtree(base)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,75 @@
+# Microbenchmark for the seen-url index: lookup cost should stay flat as the crawl grows
+# Usage: python benchmarks/seenIndexBench.py [maxUrls]
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from seenIndex import MemorySeenIndex, SQLiteSeenIndex, BloomSeenIndex
+
+LOOKUPS = 10000
+LIST_MAX = 20000 # The old list based check gets too slow to measure past this
+
+# The old class level list, kept here for comparison
+class ListSeenIndex():
+	def __init__(self):
+		self.urls = []
+
+	def add(self, url):
+		if url in self.urls:
+			return False
+		self.urls.append(url)
+		return True
+
+	def __contains__(self, url):
+		return url in self.urls
+
+def makeUrl(i):
+	return "http://example.com/section"+str(i % 97)+"/page/"+str(i)
+
+def bench(index, size, start):
+	for i in range(start, size):
+		index.add(makeUrl(i))
+
+	# Half hits, half misses
+	t = time.perf_counter()
+	for i in range(LOOKUPS//2):
+		makeUrl(i*7 % size) in index
+		makeUrl(size+i) in index
+	return (time.perf_counter()-t)/LOOKUPS*1e6
+
+def main():
+	maxUrls = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+	sizes = []
+	size = 1000
+	while size <= maxUrls:
+		sizes.append(size)
+		size *= 10
+
+	with tempfile.TemporaryDirectory() as tmp:
+		backends = {
+			"list": ListSeenIndex(),
+			"memory": MemorySeenIndex(),
+			"sqlite": SQLiteSeenIndex(os.path.join(tmp, "seen.sqlite")),
+			"bloom": BloomSeenIndex(os.path.join(tmp, "seen.bloom"), capacity=maxUrls*2)
+		}
+
+		print("urls".rjust(10)+"".join(name.rjust(12) for name in backends)+"   (us per lookup)")
+		prev = 0
+		for size in sizes:
+			row = str(size).rjust(10)
+			for name, index in backends.items():
+				if name == "list" and size > LIST_MAX:
+					row += "-".rjust(12)
+				else:
+					row += ("%.2f" % bench(index, size, prev)).rjust(12)
+			print(row)
+			prev = size
+
+		for index in backends.values():
+			if hasattr(index, "close"):
+				index.close()
+
+if __name__ == "__main__":
+	main()
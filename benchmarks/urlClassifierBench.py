@@ -0,0 +1,98 @@
+# Compares the precompiled UrlClassifier against the old substring scanning checks
+# Usage: python benchmarks/urlClassifierBench.py [numUrls]
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from urlClassifier import UrlClassifier
+from extensions import mediaExtensions
+
+SMALL_ALLOWED = ["example.com", "cdn.example.org", "static.example.net"]
+SMALL_BLOCKED = ["example.com/example/blockMe", "ads.example.com", "example.com/login"]
+
+# A bigger config, closer to a multi-site archive
+LARGE_ALLOWED = SMALL_ALLOWED+["site"+str(i)+".example.edu" for i in range(30)]
+LARGE_BLOCKED = SMALL_BLOCKED+["example.com/tag/"+str(i) for i in range(30)]
+
+ALLOWED = SMALL_ALLOWED
+BLOCKED = SMALL_BLOCKED
+
+# The old ArchiverCrawler.url_allowed and media check, kept here for comparison
+def oldUrlAllowed(link):
+	for allowedDomain in ALLOWED:
+		if allowedDomain in link:
+			blocked = False
+			for blockedSubdomain in BLOCKED:
+				if blockedSubdomain in link:
+					blocked = True
+					break
+
+			if not blocked and "@" not in link:
+				return True
+
+	return False
+
+def oldIsMedia(resource):
+	isMediaFile = False
+	for ext in mediaExtensions:
+		if "."+ext in resource:
+			isMediaFile = True
+	return isMediaFile
+
+def makeUrls(count):
+	rand = random.Random(1234)
+	hosts = ["example.com", "www.example.com", "ads.example.com", "cdn.example.org", "other.com", "notexample.com", "static.example.net", "docs.zope.org", "site7.example.edu", "example.com.evil.net"]
+	dirs = ["", "blog/", "example/blockMe/", "login/", "assets.v2/", "img/2020/", "downloads/"]
+	pages = ["", "index", "post-1", "photo.jpg", "archive.zip", "movie.mp4", "style.css", "data.tar.gz", "page.html", "readme.z"]
+	return ["http://"+rand.choice(hosts)+"/"+rand.choice(dirs)+rand.choice(pages) for _ in range(count)]
+
+def timeit(fn, urls):
+	t = time.perf_counter()
+	for url in urls:
+		fn(url)
+	return time.perf_counter()-t
+
+def compare(urls, label):
+	t = time.perf_counter()
+	classifier = UrlClassifier(ALLOWED, BLOCKED)
+	buildTime = time.perf_counter()-t
+
+	print("\n"+label+": %d allowed, %d blocked rules, classifier built in %.3fms" % (len(ALLOWED), len(BLOCKED), buildTime*1000))
+	print("check".ljust(12)+"old (s)".rjust(10)+"new (s)".rjust(10)+"speedup".rjust(10)+"differ".rjust(10))
+	for name, old, new in (("url_allowed", oldUrlAllowed, classifier.url_allowed), ("is_media", oldIsMedia, classifier.is_media)):
+		oldTime = timeit(old, urls)
+		newTime = timeit(new, urls)
+		differ = sum(1 for url in set(urls) if old(url) != new(url))
+		print(name.ljust(12)+("%.3f" % oldTime).rjust(10)+("%.3f" % newTime).rjust(10)+("%.1fx" % (oldTime/newTime)).rjust(10)+str(differ).rjust(10))
+
+	# parse_page runs both checks on every link
+	oldTime = timeit(lambda url: oldUrlAllowed(url) and oldIsMedia(url), urls)
+	newTime = timeit(lambda url: classifier.url_allowed(url) and classifier.is_media(url), urls)
+	print("per link".ljust(12)+("%.3f" % oldTime).rjust(10)+("%.3f" % newTime).rjust(10)+("%.1fx" % (oldTime/newTime)).rjust(10))
+	return classifier
+
+def main():
+	global ALLOWED, BLOCKED
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	urls = makeUrls(count)
+	print("%d urls" % count)
+
+	ALLOWED, BLOCKED = LARGE_ALLOWED, LARGE_BLOCKED
+	compare(urls, "Large config")
+	ALLOWED, BLOCKED = SMALL_ALLOWED, SMALL_BLOCKED
+	classifier = compare(urls, "Small config")
+
+	# Show a few of the cases where the old substring checks got it wrong
+	print("\nExample disagreements (url: old -> new):")
+	shown = 0
+	for url in sorted(set(urls)):
+		if oldIsMedia(url) != classifier.is_media(url) or oldUrlAllowed(url) != classifier.url_allowed(url):
+			print("  "+url+": allowed "+str(oldUrlAllowed(url))+" -> "+str(classifier.url_allowed(url))+", media "+str(oldIsMedia(url))+" -> "+str(classifier.is_media(url)))
+			shown += 1
+			if shown >= 8:
+				break
+
+if __name__ == "__main__":
+	main()
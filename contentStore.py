@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+import shutil
+import sqlite3
+import logging
+import threading
+
+LINK_MODES = ("hardlink", "symlink", "copy")
+
+# Content addressed storage for media. Every distinct file is stored once as a blob named by
+# its hash, and the url shaped paths in the archive are links to it, so the same image served
+# from many urls only takes up disk space once
+class ContentStore():
+	def __init__(self, root, linkMode="hardlink", tempFiles=None):
+		if linkMode not in LINK_MODES:
+			raise ValueError("Unknown dedupeLinkMode '"+str(linkMode)+"', expected one of "+", ".join(LINK_MODES))
+
+		self.root = root
+		self.linkMode = linkMode
+		self.tempFiles = tempFiles # TempManifest the temporary links are tracked in, if any
+		if not os.path.isdir(root):
+			os.mkdir(root)
+
+		self.lock = threading.Lock() # Blobs are stored from download worker threads
+		self.db = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False)
+		self.db.execute("PRAGMA journal_mode=WAL")
+		self.db.execute("CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER)")
+		self.db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, digest TEXT)")
+
+	@classmethod
+	def from_config(cls, config, stateDir, tempFiles=None):
+		return cls(os.path.join(stateDir, "blobs"), linkMode=config.get("dedupeLinkMode", "hardlink"), tempFiles=tempFiles)
+
+	def blob_path(self, digest):
+		return os.path.join(self.root, digest[:2], digest)
+
+	# Moves a finished download into the store and links it into place at filepath
+	def store(self, tempPath, digest, size, filepath):
+		blobPath = self.blob_path(digest)
+		with self.lock:
+			if os.path.isfile(blobPath):
+				os.remove(tempPath) # Already have these bytes
+			else:
+				direc = os.path.dirname(blobPath)
+				if not os.path.isdir(direc):
+					os.mkdir(direc)
+				os.replace(tempPath, blobPath)
+				self.db.execute("INSERT OR REPLACE INTO blobs (digest, size) VALUES (?, ?)", (digest, size))
+
+			self.db.execute("INSERT OR REPLACE INTO files (path, digest) VALUES (?, ?)", (filepath, digest))
+			self.db.commit()
+
+		self._materialize(blobPath, filepath)
+
+	# Total bytes the archive's media takes up with and without deduplication
+	def report(self):
+		with self.lock:
+			files, logicalBytes = self.db.execute("SELECT COUNT(*), COALESCE(SUM(blobs.size), 0) FROM files JOIN blobs ON files.digest=blobs.digest").fetchone()
+			blobs, storedBytes = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+		return {
+			"files": files,
+			"blobs": blobs,
+			"logicalBytes": logicalBytes,
+			"storedBytes": storedBytes,
+			"bytesSaved": logicalBytes-storedBytes
+		}
+
+	def close(self):
+		with self.lock:
+			if self.db is not None:
+				self.db.commit()
+				self.db.close()
+				self.db = None
+
+	def _materialize(self, blobPath, filepath):
+		tempLink = filepath+".temp"
+		if os.path.lexists(tempLink):
+			os.remove(tempLink)
+		if self.tempFiles is not None:
+			self.tempFiles.started(tempLink)
+
+		try:
+			if self.linkMode == "hardlink":
+				os.link(blobPath, tempLink)
+			elif self.linkMode == "symlink":
+				os.symlink(os.path.relpath(blobPath, os.path.dirname(filepath)), tempLink)
+			else:
+				shutil.copyfile(blobPath, tempLink)
+		except OSError as e:
+			# e.g. the archive is on another filesystem than the state folder
+			logging.warning("Couldn't "+self.linkMode+" '"+filepath+"' to its blob, copying instead: "+str(e))
+			shutil.copyfile(blobPath, tempLink)
+		os.replace(tempLink, filepath) # Swap in atomically, replacing any older copy
+		if self.tempFiles is not None:
+			self.tempFiles.finished(tempLink)
+
+# Prints the dedupe report of an archive: python contentStore.py <stateFolder>
+if __name__ == "__main__":
+	store = ContentStore(os.path.join(sys.argv[1], "blobs"))
+	print(json.dumps(store.report(), indent=4))
+	store.close()
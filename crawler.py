@@ -1,26 +1,35 @@
 import os
 import time
+import requests
 from tqdm import tqdm
 import logging
-import requests
 
-from pageRequest import SplashRequest, LocalRequest
-from pathUtils import is_path_exists_or_creatable
-from extensions import mediaExtensions
+from pageRequest import SplashRequest, LocalRequest, DirectRequest
+from fsCache import fsCache
+from urlClassifier import UrlClassifier
+from frontier import CrawlFrontier
+from seenIndex import makeSeenIndex
+from renderPool import RenderPool
+from splashPool import SplashPool
+from renderPolicy import RenderPolicy
+from downloadEngine import DownloadEngine
+from redirectResolver import RedirectResolver
+from journal import CrawlJournal
+from pageMeta import PageMetaStore, contentHash
+from contentStore import ContentStore
+from tempManifest import TempManifest
+from storage import makeStorage
+from parseStage import ParseStage, parseBody
+from politeness import Politeness, RetryQueue, RETRY_STATUSES, retryAfterSeconds
 import parseUtils
 
 cwd = os.path.dirname(os.path.realpath(__file__))
 
-# TODO: Depth limit https://stackoverflow.com/questions/27805952/scrapy-set-depth-limit-per-allowed-domains
 # Possibly limit it in other ways https://stackoverflow.com/questions/30448532/scrapy-wait-for-a-specific-url-to-be-parsed-before-parsing-others
 # TODO: Fix local file storage
-# Stop using response.css, go back to passthrough and use use https://github.com/scrapy/parsel instead to extract with text=response.body
 # Also possibly fix links in external files to always point to local directory instead of remote?
 
 class ArchiverCrawler():
-	links = []
-	crawledCount = 0
-
 	def __init__(self, config, **kw):
 		super(ArchiverCrawler, self).__init__()
 		# Setup logging
@@ -32,7 +41,38 @@ class ArchiverCrawler():
 		self.start_urls = config["startUrls"]
 		self.allowed_domains = config["allowedDomains"]
 		self.blocked_subdomains = config["blockedSubdomains"]
+		self.classifier = UrlClassifier.from_config(config)
 		self.discoveredLinks = len(self.start_urls)
+		self.crawledCount = 0
+		self.mediaByType = 0 # Links sent straight to the downloader because of their Content-Type
+		self.stateDir = parseUtils.getStateDir(config)
+		# Started first, so the worker processes are forked before any threads or databases exist
+		self.parseStage = ParseStage.from_config(config) if config.get("parseProcesses", False) else None
+		self.frontier = CrawlFrontier.from_config(config)
+		self.tempFiles = TempManifest.from_config(config, self.stateDir) # So cleanup doesn't have to walk the whole archive
+		fsCache.onCreate = self.tempFiles.created_dir
+		# On-disk seen indexes persist themselves, the in-memory one is rebuilt from the journal
+		self.journal = CrawlJournal.from_config(config, self.stateDir, logSeen=config.get("seenIndex", "memory") == "memory")
+		self.links = makeSeenIndex(config, self.stateDir, reset=not self.journal.resuming) # Every link we've already queued or rejected
+		self.splash = SplashPool.from_config(config) # Splash instances renders are spread over
+		self.renderPolicy = RenderPolicy.from_config(config, self.stateDir) # Which pages actually need Splash
+		self.renderPool = RenderPool.from_config(config, self.render_page)
+		# Every request to a host goes through its rate limit, hosts that struggle get backed off and retried later
+		self.politeness = Politeness.from_config(config)
+		self.retries = RetryQueue.from_config(config)
+		self.redirects = RedirectResolver.from_config(config, os.path.join(self.stateDir, "redirects.sqlite"), politeness=self.politeness)
+		# Directories are created before queueing, so workers don't need to touch them
+		# Incremental recrawls refresh local copies the server says have changed
+		self.pageMeta = PageMetaStore.from_config(config, self.stateDir) if config.get("incremental", False) else None
+		self.refreshedMedia = set() # Media already checked for changes this run
+		self.contentStore = ContentStore.from_config(config, self.stateDir, self.tempFiles) if config.get("dedupeMedia", False) and config.get("storage", "files") == "files" else None
+		# Local copies of pages and media, as files or WARC records
+		self.storage = makeStorage(config, os.path.join(cwd, config["folderName"]), self.tempFiles, self.contentStore)
+		self.downloads = DownloadEngine.from_config(
+			config,
+			lambda url, filepath, session: self.download_media_session(url, filepath, session, subdirs=False),
+			onDone=self.media_done
+		)
 
 		print("ArchiverCrawler instantiated\nstartUrls:")
 		for url in self.start_urls:
@@ -56,27 +96,269 @@ class ArchiverCrawler():
 		self.pbar = tqdm(total=self.discoveredLinks, ascii=True)
 		self.pbar.update(0)
 
-		# Remove previous temp files
-		num = parseUtils.removeTempFiles(os.path.join(cwd, self.config["folderName"]))
+		# Remove previous temp files, the whole archive is only searched if nothing was tracked
+		if self.tempFiles.tracked:
+			num = self.tempFiles.remove_temps()
+		else:
+			num = parseUtils.removeTempFiles(os.path.join(cwd, self.config["folderName"]))
 		if num>0:
 			logging.info("Cleaned directory structure and removed %d temporary files from previous run", num)
 
-		for url in self.start_urls:
-			self.parse_page(SplashRequest(url, self.allowed_domains, self.config["splashStrictDomains"]))
+		if self.journal.resuming:
+			self.resume()
+		else:
+			for url in self.start_urls:
+				self.mark_seen(url)
+				self.queue_links([url], 0)
+
+		try:
+			# Crawl loop; pages push their links back onto the frontier instead of recursing into them
+			while len(self.frontier) > 0 or len(self.renderPool) > 0 or len(self.retries) > 0:
+				for item in self.retries.due():
+					self.retry(item)
+
+				# Keep the render pool topped up, local copies are parsed straight away
+				while len(self.frontier) > 0 and self.renderPool.has_capacity():
+					entry = self.frontier.pop()
+					self.crawl_link(entry.url, entry.depth)
+
+				if len(self.renderPool) > 0:
+					# Don't sit on a retry that's due while waiting for renders
+					for result in self.renderPool.completed(timeout=self.retries.wait_time()):
+						self.handle_render(result)
+				elif len(self.frontier) == 0:
+					time.sleep(self.retries.wait_time() or 0)
+
+				if self.journal.needs_compaction():
+					self.compact_journal()
+
+			self.pbar.set_description("Finishing "+str(len(self.downloads))+" download(s)")
+			self.downloads.drain()
+			# Failed downloads can still be waiting for another go
+			while len(self.retries) > 0:
+				time.sleep(self.retries.wait_time() or 0)
+				for item in self.retries.due():
+					self.retry(item)
+				self.downloads.drain()
+		except KeyboardInterrupt:
+			# Everything not finished is still pending in the journal, so the next run picks it up
+			logging.warning("Interrupted, progress saved; run again to resume")
+			self.renderPool.abort()
+			self.downloads.abort()
+			if self.parseStage is not None:
+				self.parseStage.abort()
+			self.journal.close()
+			self.tempFiles.close()
+			self.pbar.close()
+			raise
+
+		self.journal.complete()
 		self.cleanup()
+
+	# Picks an interrupted crawl back up from the journal, without re-parsing finished pages
+	def resume(self):
+		seen, pages, media = self.journal.resume_state()
+		for url in seen:
+			self.links.add(url)
+		for url, depth in pages:
+			self.frontier.push(url, depth)
+
+		self.crawledCount = self.journal.doneCount
+		self.discoveredLinks = self.crawledCount+len(pages)
+		self.pbar.n = self.crawledCount
+		self.pbar.total = self.discoveredLinks
+		self.pbar.refresh()
+		logging.info("Resuming crawl: %d page(s) done, %d page(s) and %d download(s) left", self.crawledCount, len(pages), len(media))
+
+		# Rewrite the journal straight away, this also drops a torn last record
+		self.compact_journal()
+		for url, path in media:
+			self.download_media(url, path)
+
+	def compact_journal(self):
+		self.journal.compact(iter(self.links) if self.journal.logSeen else None)
+
+	def mark_seen(self, url):
+		if self.links.add(url):
+			self.journal.seen_url(url)
+			return True
+		return False
+
+	# Pushes links onto the frontier and journals the ones that made it, returns how many did
+	def queue_links(self, links, depth):
+		added = self.frontier.extend(links, depth)
+		for link in added:
+			self.journal.queued_page(link, depth)
+		return len(added)
 	
+	# Sends a failed fetch that's due again back to the render pool or the downloader
+	def retry(self, item):
+		logging.debug("RETRY: "+item.kind+" "+item.url+" (attempt "+str(item.attempt+1)+")")
+		if item.kind == "page":
+			self.renderPool.submit(item.url, item.extra)
+		else:
+			self.downloads.submit(item.url, item.extra)
+
+	# Downloads waiting for a retry aren't finished yet, so they stay pending in the journal
+	def media_done(self, stat):
+		if stat.ok or not self.retries.is_queued("media", stat.url):
+			self.journal.saved_media(stat.filepath)
+
 	def cleanup(self):
 		self.pbar.close()
+		self.renderPool.close()
+		self.splash.close()
+		self.renderPolicy.close()
+		if self.parseStage is not None:
+			self.parseStage.close()
+		self.downloads.close()
+		self.storage.close()
+		self.redirects.close()
+		self.frontier.close()
+		self.journal.close()
+		if self.pageMeta is not None:
+			logging.info("Incremental recrawl: %d page(s) and media file(s) unchanged, %d changed", self.pageMeta.unchanged, self.pageMeta.changed)
+			self.pageMeta.close()
+		if self.contentStore is not None:
+			report = self.contentStore.report()
+			logging.info("Dedupe: %d media file(s) stored as %d blob(s), %.1f MB saved (%.1f MB stored of %.1f MB)", report["files"], report["blobs"], report["bytesSaved"]/1e6, report["storedBytes"]/1e6, report["logicalBytes"]/1e6)
+			self.contentStore.close()
+		policy = self.renderPolicy.stats()
+		logging.info("Render policy: %d page(s) fetched without Splash (renders avoided), %d sent straight to Splash, %d escalated to Splash after a plain fetch, %d url pattern(s) remembered", policy["rendersAvoided"], policy["rendered"], policy["escalated"], policy["patterns"])
+		for endpoint in self.splash.stats():
+			logging.info("Splash at %s: %d render(s), %d failed, %s", endpoint["url"], endpoint["renders"], endpoint["failed"], "%.2fs average" % endpoint["latency"] if endpoint["latency"] is not None else "no renders")
+		if self.splash.retried > 0:
+			logging.info("Retried %d render(s) on another Splash instance", self.splash.retried)
+		polite = self.politeness.stats()
+		logging.info("Politeness: %d host(s), %.1fs spent waiting on rate limits and backoff, backed off %d time(s), %d host(s) still slowed down", polite["hosts"], polite["waited"], polite["backoffs"], polite["slowedHosts"])
+		logging.info("Retried %d failed fetch(es), gave up on %d", self.retries.retried, self.retries.gaveUp)
+		stats = self.downloads.stats()
+		logging.info("Resolved redirects for %d link(s), %d from the redirect map", self.redirects.hits+self.redirects.misses, self.redirects.hits)
+		logging.info("Sent %d extensionless media link(s) straight to the downloader", self.mediaByType)
+		logging.info("Downloaded %d media file(s), %.1f MB in %.1fs (%.2f MB/s), %d failed", stats["files"], stats["bytes"]/1e6, stats["seconds"], stats["bytesPerSecond"]/1e6, stats["failed"])
+		fsStats = fsCache.stats()
+		logging.info("Filesystem: %d syscall(s) for folders and path checks (%d mkdir, %d stat, %d lstat, %d access), %d folder and %d path check(s) answered from cache", fsStats["syscalls"], fsStats["mkdir"], fsStats["stat"], fsStats["lstat"], fsStats["access"], fsStats["dirHits"], fsStats["pathHits"])
+		self.links.close()
 		logging.debug("Now cleaning folder structure...")
 		direc = os.path.join(cwd, self.config["folderName"])
-		num = parseUtils.removeEmptyFolders(direc)
-		logging.info("Cleaned directory structure and removed %d empty folders", num)
-		num = parseUtils.removeTempFiles(direc)
-		logging.info("Cleaned directory structure and removed %d temporary files", num)
+		if self.tempFiles.tracked and not self.config.get("fullCleanupSweep", False):
+			# Only what this crawl (or an interrupted one before it) touched
+			temps = self.tempFiles.remove_temps()
+			removed = self.tempFiles.remove_empty_dirs()
+			for path in removed:
+				fsCache.forget(path)
+			folders = len(removed)
+		else:
+			temps, folders = parseUtils.sweepArchive(direc)
+		self.tempFiles.reset()
+		self.tempFiles.close()
+		logging.info("Cleaned directory structure and removed %d empty folders", folders)
+		logging.info("Cleaned directory structure and removed %d temporary files", temps)
+
+
+	def crawl_link(self, link, depth):
+		try:
+			# First we check if a local copy exists on the disk (start urls are always rendered fresh)
+			filepath = self.get_url_filepath(link)
+			if self.pageMeta is not None:
+				# Incremental recrawl, a render worker asks the server whether any local copy is still current
+				self.renderPool.submit(link, depth)
+			elif self.parseStage is not None:
+				# Local copies are read and parsed on a render worker too, the crawl loop only merges results
+				self.renderPool.submit(link, depth)
+			elif depth > 0 and self.storage.path_ok(filepath) and self.storage.has(filepath):
+				filedata = self.storage.read_page(filepath)
+				logging.debug("RESPONSE: Local file at "+filepath+" being used")
+				res = self.parse_page(LocalRequest(link, filedata), depth)
+				if not res: #Error discovered
+					logging.warn("NoneType in response discovered; was probably media (LocalCache)")
+					self.download_media(link, filepath)
+				self.journal.done_page(link)
+			else:
+				# No local resource exists, so crawl it
+				logging.debug("RESPONSE: Remote dir "+link+" being used")
+				self.renderPool.submit(link, depth)
+		except Exception as e:
+			logging.warn("Uhoh, something bad happened crawling '"+link+"'. Error:\n"+str(e))
+
+	# Runs on a render pool worker thread
+	def render_page(self, link, depth=0):
+		response = self.fetch_page(link, depth)
+		if self.parseStage is not None and response.status != 404 and response.body is not None:
+			response.parsed = self.parseStage.parse(response.url, response.body)
+		return response
+
+	# Runs on a render pool worker thread
+	def fetch_page(self, link, depth):
+		if self.pageMeta is None:
+			filepath = self.get_url_filepath(link)
+			if self.parseStage is not None and depth > 0 and self.storage.has(filepath):
+				filedata = self.storage.read_page(filepath)
+				logging.debug("RESPONSE: Local file at "+filepath+" being used")
+				return LocalRequest(link, filedata)
+			return self.fetch_remote(link)
+
+		filepath = self.get_url_filepath(link)
+		hasLocal = self.storage.has(filepath)
+		self.politeness.wait(link)
+		changed, etag, lastModified = self.pageMeta.probe(link)
+		if hasLocal and not changed:
+			filedata = self.storage.read_page(filepath)
+			logging.debug("RESPONSE: Local file at "+filepath+" unchanged on server")
+			return LocalRequest(link, filedata)
+
+		response = self.fetch_remote(link)
+		response.refresh = hasLocal # Replace the stale local copy
+		response.etag = etag
+		response.lastModified = lastModified
+		return response
+
+	# Runs on a render pool worker thread. Pages are fetched with a plain GET when the render
+	# policy says their html has everything, and rendered by Splash otherwise
+	def fetch_remote(self, link):
+		if self.renderPolicy.decide(link) == "direct":
+			response = self.polite_fetch(link, lambda: DirectRequest(link, self.renderPolicy.session))
+			if response.body is None or not self.renderPolicy.needs_render(link, response.body):
+				return response
+		return self.polite_fetch(link, lambda: SplashRequest(link, self.allowed_domains, self.config["splashStrictDomains"], splash=self.splash))
+
+	# Waits for the host's turn, then lets it know how the fetch went
+	def polite_fetch(self, link, fetch):
+		self.politeness.wait(link)
+		start = time.perf_counter()
+		try:
+			response = fetch()
+		except Exception:
+			self.politeness.observe(link, None, time.perf_counter()-start)
+			raise
+		self.politeness.observe(link, response.status, time.perf_counter()-start, getattr(response, "headers", None))
+		return response
+
+	def handle_render(self, result):
+		# Failures that may go away are tried again later, the page stays pending until then
+		if result.error is not None or result.response.status in RETRY_STATUSES:
+			delay = retryAfterSeconds(getattr(result.response, "headers", None)) if result.error is None else None
+			if self.retries.schedule("page", result.url, result.depth, delay=delay):
+				logging.debug("RETRY: will try '"+result.url+"' again ("+str(result.error or result.response.status)+")")
+				return
+			if result.error is not None:
+				logging.warn("Uhoh, something bad happened rendering '"+result.url+"'. Error:\n"+str(result.error))
+				return
+			logging.warn("Giving up on '"+result.url+"', it kept answering "+str(result.response.status))
+			self.journal.done_page(result.url)
+			return
 
+		try:
+			res = self.parse_page(result.response, result.depth)
+			if not res and result.depth > 0:
+				logging.warn("NoneType in response discovered; was probably media (SplashRequest)")
+				self.download_media(result.url, self.get_url_filepath(result.url))
+		except Exception as e:
+			logging.warn("Uhoh, something bad happened crawling '"+result.url+"'. Error:\n"+str(e))
+		self.journal.done_page(result.url)
 
 	# All the actual things
-	def parse_page(self, response):
+	def parse_page(self, response, depth=0):
 		self.crawledCount+=1
 		self.pbar.n = self.crawledCount
 		self.pbar.set_description(response.url)
@@ -89,87 +371,94 @@ class ArchiverCrawler():
 					logging.warn("Response.body=None on "+response.url)
 					return False
 				
+				# Links and media on the page, already extracted if the parse stage is in use
+				parsed = getattr(response, "parsed", None)
+				if parsed is None:
+					parsed = parseBody(self.config, response.url, response.body, self.classifier)
+
 				# Extract subdirectory, page, path from url
 				URLparts = parseUtils.extractURLParts(response.url)
 				
 				# Ensure the subdirs exist, since we're not in a root directory
-				parseUtils.createSubdirs(os.path.join(cwd, self.config["folderName"]), URLparts["fullPath"])
-				filepath = self.get_url_filepath(response.url)
-				tempfilepath = filepath+".temp"
-
-				if is_path_exists_or_creatable(filepath):
-					if not os.path.exists(filepath): # Ensure we don't overwrite
-						logging.debug("FILE WRITE: "+filepath)
-						with open(tempfilepath, 'w', encoding="utf8", errors="ignore") as f:
-								f.write(response.body)
-						os.rename(tempfilepath, filepath) # Move finished file to final path
+				if self.storage.needsFolders:
+					parseUtils.createSubdirs(os.path.join(cwd, self.config["folderName"]), URLparts["fullPath"])
+				filepath = parsed.filepath
+
+				if self.storage.path_ok(filepath):
+					refresh = getattr(response, "refresh", False)
+					if not self.storage.has(filepath) or refresh: # Ensure we don't overwrite, unless it's a refresh of a changed page
+						bodyHash = None
+						if self.pageMeta is not None:
+							bodyHash = contentHash(response.body)
+							meta = self.pageMeta.get(response.url)
+
+						if refresh and meta is not None and meta.contentHash == bodyHash:
+							logging.debug("FILE UNCHANGED: "+filepath)
+						else:
+							logging.debug("FILE WRITE: "+filepath)
+							self.storage.write_page(response.url, filepath, response.body)
+
+						if self.pageMeta is not None:
+							self.pageMeta.update(response.url, getattr(response, "etag", None), getattr(response, "lastModified", None), bodyHash)
 				else:
 					logging.warn("FILE INVALID PATH: "+filepath)
 
 
 				# Define links array
-				resources = []
-				tempResources = []
+				resources = list(parsed.media)
 
 				mediaUrls = []
 				mediaPaths = []
 
 				nextLinks = []
-				
-				# Extract all media and links
-				tempResources += response.css('*::attr(src)').getall()
-				tempResources += response.css('*::attr(href)').getall()
-				tempResources += response.css('*::attr(background)').getall()
-
-				# Make things absolute and clean it
-				for idx in range(0, len(tempResources)):
-					tempResources[idx] = parseUtils.cleanLink(parseUtils.forceAbsoluteLink(response.url, tempResources[idx]))
-				tempResources = [i for i in tempResources if i] # Filter "None" invalid links
-
-				# Filter non germane links
-				for res in tempResources:
-					if self.url_allowed(res):
-						resources.append(res)
-					else:
-						logging.debug("GotLink nOK: "+res)
 
-				tempResources = resources # reuse for next filtering step
-				resources = []
+				newLinks = [link for link in parsed.links if self.mark_seen(link)]
 
-				# Filter by media file
-				with requests.Session() as s:
-					for resource in tempResources:
-						isMediaFile = False
-						for ext in mediaExtensions:
-							if "."+ext in resource:
-								isMediaFile = True
-
-						if isMediaFile:
-							resources.append(resource)
+				# It's a link, so first get all redirects; local copies don't need a remote fetch and follow
+				localLinks = set()
+				remoteLinks = []
+				for resource in newLinks:
+					filepath = self.get_url_filepath(resource)
+					if self.storage.path_ok(filepath) and self.storage.has(filepath):
+						localLinks.add(resource)
+					else:
+						remoteLinks.append(resource)
+
+				followed = {record.url: record for record in self.redirects.resolve(remoteLinks)}
+				for resource in newLinks:
+					if resource in localLinks:
+						# The redirect map may already know where this local copy came from and whether it's media
+						record = self.redirects.lookup(resource)
+						if record is None:
+							nextLinks.append(resource)
+						elif record.final != resource and not self.mark_seen(record.final):
+							logging.debug("FollowLink nOK: "+resource+" | "+record.final+", seen=True")
+						elif record.status == 200 and not parseUtils.isPageContentType(record.contentType, record.contentLength, self.config.get("maxPageBytes")):
+							resources.append(record.final)
+						else:
+							nextLinks.append(record.final)
+						continue
+
+					record = followed[resource]
+					if record.error is not None:
+						# Crawled as it is, rendering it gets retried if the host is only struggling
+						logging.warn("Uhoh, something bad happened while following link '"+resource+"': "+str(record.error))
+						nextLinks.append(resource)
+					# A link that didn't redirect was marked seen just above, so only redirect targets need the seen check
+					elif self.url_allowed(record.final) and (record.final == resource or self.mark_seen(record.final)):
+						if record.status == 200 and not parseUtils.isPageContentType(record.contentType, record.contentLength, self.config.get("maxPageBytes")):
+							# Media without a known extension, download it directly instead of wasting a render on it
+							logging.debug("FollowLink media: "+record.final+" ("+str(record.contentType)+")")
+							resources.append(record.final)
+							self.mediaByType += 1
 						else:
-							if resource not in self.links:
-								self.links.append(resource)
-								try:
-									# It's a link, so first get all redirects
-									filepath = self.get_url_filepath(resource)
-									if is_path_exists_or_creatable(filepath) and os.path.isfile(filepath): # We have a local copy already? Well then we don't need to do remote fetch and follow
-										nextLinks.append(resource)
-									else:
-										with s.head(resource, allow_redirects=True, timeout=12) as followedLink: # Don't get the content, just redirect headers
-											if followedLink.url not in self.links and self.url_allowed(followedLink.url):
-												if followedLink.url != resource:
-													self.links.append(followedLink.url)
-												# It's a link, so add it to links collection and links to crawl
-												nextLinks.append(followedLink.url)
-											else:
-												logging.debug("FollowLink nOK: "+resource+" | "+followedLink.url+", seen="+str(followedLink.url in self.links)+", allowed="+str(self.url_allowed(followedLink.url)))
-								except Exception as e:
-									logging.warn("Uhoh, something bad happened while following link '"+resource+"': "+str(e))
-							
-				del tempResources # Free mem
+							# It's a link, so add it to links collection and links to crawl
+							nextLinks.append(record.final)
+					else:
+						logging.debug("FollowLink nOK: "+resource+" | "+record.final+", seen="+str(record.final in self.links)+", allowed="+str(self.url_allowed(record.final)))
 
 				# Extract the media links
-				result = parseUtils.extractMedia(self.config, response.url, resources) # Remaining resources are all media files
+				result = parseUtils.extractMedia(self.config, response.url, resources, subdirs=self.storage.needsFolders) # Remaining resources are all media files
 				del resources # Free mem
 				mediaUrls += result["urls"]
 				mediaPaths += result["paths"]
@@ -182,47 +471,28 @@ class ArchiverCrawler():
 				logging.debug(mediaPaths)
 
 				# Filter media already downloaded
-				with requests.Session() as s:
-					for idx in range(0, len(mediaPaths)):
-						path = mediaPaths[idx]
-						url = mediaUrls[idx]
-
-						try:
-							if is_path_exists_or_creatable(path) and not os.path.isfile(path):
-								logging.debug("MEDIA: downloading "+url)
-
-								# Do the download
-								self.download_media_session(url, path, s)
-							else:
-								logging.debug("MEDIA: Local copy of "+url+" being used")
-						except Exception as e:
-							logging.warn("Uhoh, something bad happened when trying to download '"+url+"': "+e)
+				for idx in range(0, len(mediaPaths)):
+					path = mediaPaths[idx]
+					url = mediaUrls[idx]
+
+					try:
+						if self.storage.path_ok(path) and (not self.storage.has(path) or self.media_needs_refresh(path)):
+							logging.debug("MEDIA: queueing download of "+url)
+
+							# Queue the download, it happens in the background
+							self.download_media(url, path, subdirs=False) # extractMedia already made the subdirs
+						else:
+							logging.debug("MEDIA: Local copy of "+url+" being used")
+					except Exception as e:
+						logging.warn("Uhoh, something bad happened when trying to download '"+url+"': "+str(e))
 
 				if len(nextLinks) > 0:
-					logging.debug("\nDiscovered "+str(len(nextLinks))+" new link(s)")
-					self.discoveredLinks+=len(nextLinks)
+					added = self.queue_links(nextLinks, depth+1)
+					logging.debug("\nDiscovered "+str(len(nextLinks))+" new link(s), "+str(added)+" queued")
+					self.discoveredLinks+=added
 					self.pbar.total = self.discoveredLinks
 					self.pbar.refresh()
 
-					for link in nextLinks:
-						# First we check if a local copy exists on the disk
-						filepath = self.get_url_filepath(link)
-						if is_path_exists_or_creatable(filepath) and os.path.isfile(filepath):
-							with open(filepath, 'r', encoding="utf8", errors="ignore") as file:
-								filedata = file.read()
-							logging.debug("RESPONSE: Local file at "+filepath+" being used")
-							res = self.parse_page(LocalRequest(link, filedata))
-							if not res: #Error discovered
-								logging.warn("NoneType in response discovered; was probably media (LocalCache)")
-								self.download_media(link, filepath)
-						else:
-							# No local resource exists, so crawl it
-							logging.debug("RESPONSE: Remote dir "+link+" being used")
-							res = self.parse_page(SplashRequest(link, self.allowed_domains, self.config["splashStrictDomains"]))
-							if not res:
-								logging.warn("NoneType in response discovered; was probably media (SplashRequest)")
-								self.download_media(link, self.get_url_filepath(link))
-
 				else:
 					logging.debug("NO LINKS FOUND IN: "+response.url)
 		except Exception as e:
@@ -230,66 +500,87 @@ class ArchiverCrawler():
 
 		return True
 
+	# Queues a download on the download engine, returns False if it couldn't be queued
 	def download_media(self, url, filepath, subdirs=True):
 		url = url.strip().strip('"')
 		filepath = filepath.strip().strip('"')
-		tempfilepath = filepath+".temp"
 
-		if subdirs:
+		if subdirs and self.storage.needsFolders:
 			parseUtils.createSubdirs(os.path.join(cwd, self.config["folderName"]), parseUtils.extractURLParts(url)["fullPath"])
 
-		if not os.path.exists(filepath):
-			r = requests.get(url, stream=True)
-			if r.status_code == 200:
-				with open(tempfilepath, 'wb') as f:
-					for chunk in r:
-						f.write(chunk)
-				os.rename(tempfilepath, filepath) # Move finished file to final path
-				r.close()
-			else:
-				r.close()
-				return False
+		if not self.storage.has(filepath) or self.media_needs_refresh(filepath):
+			if self.pageMeta is not None:
+				self.refreshedMedia.add(filepath)
+			self.journal.queued_media(url, filepath) # Journaled first, the download can finish before submit returns
+			return self.downloads.submit(url, filepath)
 
 		return True
 
+	# Incremental recrawls check every existing media file with the server once per run
+	def media_needs_refresh(self, filepath):
+		return self.pageMeta is not None and filepath not in self.refreshedMedia
+
+	# Does the actual download, runs on a download engine worker thread. Returns the number of bytes written
 	def download_media_session(self, url, filepath, session, subdirs=True):
 		url = url.strip().strip('"')
 		filepath = filepath.strip().strip('"')
-		tempfilepath = filepath+".temp"
 
-		if subdirs:
+		if subdirs and self.storage.needsFolders:
 			parseUtils.createSubdirs(os.path.join(cwd, self.config["folderName"]), parseUtils.extractURLParts(url)["fullPath"])
 
-		if not os.path.exists(filepath):
-			r = session.get(url, stream=True)
-			if r.status_code == 200:
-				with open(tempfilepath, 'wb') as f:
-					for chunk in r:
-						f.write(chunk)
-				os.rename(tempfilepath, filepath) # Move finished file to final path
-				r.close()
-			else:
-				r.close()
+		headers = {}
+		if self.storage.has(filepath):
+			if self.pageMeta is None:
+				return 0
+
+			# Incremental recrawl, only download it again if the server says it changed
+			meta = self.pageMeta.get(url)
+			if meta is None:
+				self.politeness.wait(url)
+				self.pageMeta.probe(url, session=session) # Keeps the local copy and remembers its validators
+				return 0
+			headers = self.pageMeta.conditional_headers(meta)
+
+		self.politeness.wait(url)
+		start = time.perf_counter()
+		try:
+			r = session.get(url, stream=True, headers=headers)
+		except requests.exceptions.RequestException as e:
+			self.politeness.observe(url, None, time.perf_counter()-start)
+			if self.retries.schedule("media", url, filepath):
+				logging.debug("RETRY: will download '"+url+"' again ("+str(e)+")")
 				return False
-
-		return True
+			raise
+		self.politeness.observe(url, r.status_code, time.perf_counter()-start, r.headers)
+
+		if r.status_code in RETRY_STATUSES and self.retries.schedule("media", url, filepath, delay=retryAfterSeconds(r.headers)):
+			r.close()
+			logging.debug("RETRY: will download '"+url+"' again ("+str(r.status_code)+")")
+			return False
+		if r.status_code == 304:
+			r.close()
+			self.pageMeta.update(url)
+			with self.pageMeta.lock:
+				self.pageMeta.unchanged += 1
+			return 0
+		elif r.status_code == 200:
+			# Hashed while streaming for change tracking
+			written, digest = self.storage.write_media(url, filepath, r, contentType=r.headers.get("Content-Type"), hashed=self.pageMeta is not None)
+			r.close()
+
+			if self.pageMeta is not None:
+				if len(headers) > 0:
+					with self.pageMeta.lock:
+						self.pageMeta.changed += 1
+				self.pageMeta.update(url, r.headers.get("ETag"), r.headers.get("Last-Modified"), digest)
+		else:
+			r.close()
+			return False
+
+		return written
 
 	def get_url_filepath(self, link):
-		parts = parseUtils.extractURLParts(link)
-		filepath = os.path.join(cwd, self.config["folderName"], *parts["fullPath"], parts["page"])
-
-		return filepath
+		return parseUtils.getUrlFilepath(self.config, link)
 
 	def url_allowed(self, link):
-		for allowedDomain in self.allowed_domains:
-			if allowedDomain in link:
-				blocked = False
-				for blockedSubdomain in self.blocked_subdomains:
-					if blockedSubdomain in link:
-						blocked = True
-						break
-
-				if not blocked and "@" not in link: # Filter emails
-					return True
-
-		return False
+		return self.classifier.url_allowed(link)
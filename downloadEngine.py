@@ -0,0 +1,110 @@
+import time
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DownloadStat = namedtuple("DownloadStat", ["url", "filepath", "bytes", "seconds", "ok"])
+
+# Crawler wide media downloader. One session is shared by every worker, so keep-alive connections
+# are pooled per host for the whole crawl instead of being thrown away after each page
+class DownloadEngine():
+	def __init__(self, download, workers=8, hostPools=16, onDone=None):
+		self.download = download # Called as download(url, filepath, session) on a worker thread, returns bytes written or False
+		self.onDone = onDone # Called with the DownloadStat of every finished download, on the worker thread
+		self.workers = max(1, workers)
+
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=hostPools, pool_maxsize=self.workers)
+		self.session.mount("http://", adapter)
+		self.session.mount("https://", adapter)
+
+		self.executor = ThreadPoolExecutor(max_workers=self.workers)
+		self.lock = threading.Lock()
+		self.pending = {} # filepath -> future, so the same file is never fetched twice at once
+
+		self.startTime = None
+		self.files = 0
+		self.failed = 0
+		self.bytes = 0
+		self.busySeconds = 0.0
+
+	@classmethod
+	def from_config(cls, config, download, onDone=None):
+		return cls(
+			download,
+			workers=config.get("downloadWorkers", 8),
+			hostPools=config.get("downloadHostPools", 16),
+			onDone=onDone
+		)
+
+	def __len__(self):
+		with self.lock:
+			return len(self.pending)
+
+	# Queues a download and returns straight away; False if that file is already being fetched
+	def submit(self, url, filepath):
+		with self.lock:
+			if filepath in self.pending:
+				return False
+			if self.startTime is None:
+				self.startTime = time.perf_counter()
+			future = self.executor.submit(self._run, url, filepath)
+			self.pending[filepath] = future
+		return True
+
+	# Blocks until everything queued so far has finished
+	def drain(self):
+		with self.lock:
+			futures = list(self.pending.values())
+		wait(futures)
+
+	def stats(self):
+		with self.lock:
+			elapsed = time.perf_counter()-self.startTime if self.startTime is not None else 0.0
+			return {
+				"files": self.files,
+				"failed": self.failed,
+				"bytes": self.bytes,
+				"seconds": elapsed,
+				"bytesPerSecond": self.bytes/elapsed if elapsed > 0 else 0.0,
+				"busySeconds": self.busySeconds
+			}
+
+	def close(self):
+		self.executor.shutdown(wait=True)
+		self.session.close()
+
+	# Drops queued downloads that haven't started, for when the crawl is interrupted
+	def abort(self):
+		self.executor.shutdown(wait=False, cancel_futures=True)
+
+	def _run(self, url, filepath):
+		start = time.perf_counter()
+		try:
+			written = self.download(url, filepath, self.session)
+			ok = written is not False
+		except Exception as e:
+			logging.warn("Uhoh, something bad happened when trying to download '"+url+"': "+str(e))
+			written = False
+			ok = False
+		seconds = time.perf_counter()-start
+
+		stat = DownloadStat(url, filepath, written if ok else 0, seconds, ok)
+		with self.lock:
+			del self.pending[filepath]
+			self.busySeconds += seconds
+			if ok:
+				self.files += 1
+				self.bytes += stat.bytes
+			else:
+				self.failed += 1
+
+		if ok and stat.bytes > 0:
+			logging.debug("MEDIA: downloaded %s (%d bytes in %.2fs, %.1f KB/s)", url, stat.bytes, seconds, stat.bytes/1024/max(seconds, 1e-6))
+		if self.onDone is not None:
+			self.onDone(stat)
+		return stat
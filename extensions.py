@@ -114,4 +114,10 @@ mediaExtensions = [
 	"wss",
 	"do",
 	"action"
-]
\ No newline at end of file
+]
+
+# Content types that are rendered as pages, anything else is downloaded as media
+pageContentTypes = [
+	"text/html",
+	"application/xhtml+xml"
+]
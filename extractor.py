@@ -0,0 +1,145 @@
+import re
+from collections import namedtuple
+from html.parser import HTMLParser
+
+from lxml import etree
+
+# One reference to another resource found in a page. kind is what referenced it:
+#   "src", "href", "background", "poster", "data"   a plain url attribute
+#   "srcset"                                        one candidate of a srcset
+#   "preload"                                       <link rel=preload/prefetch/stylesheet/icon...>
+#   "style"                                         url() in a style="" attribute
+#   "css"                                           url() or @import inside a <style> element
+Resource = namedtuple("Resource", ["url", "kind", "attr"])
+
+URL_ATTRS = {
+	"src": "src",
+	"href": "href",
+	"background": "background",
+	"poster": "poster",
+	"data-src": "data", # Lazy loading images
+	"data-href": "data",
+	"data-background": "data"
+}
+SRCSET_ATTRS = ("srcset", "data-srcset", "imagesrcset")
+PRELOAD_RELS = ("preload", "prefetch", "modulepreload", "stylesheet", "icon", "apple-touch-icon", "manifest")
+
+CSS_URL = re.compile(r"""url\(\s*(['"]?)(.*?)\1\s*\)""", re.IGNORECASE)
+CSS_IMPORT = re.compile(r"""@import\s+(['"])(.*?)\1""", re.IGNORECASE)
+
+def parseSrcset(value):
+	# "a.jpg 1x, b.jpg 2x" -> ["a.jpg", "b.jpg"]
+	urls = []
+	for candidate in value.split(","):
+		candidate = candidate.strip()
+		if candidate:
+			urls.append(candidate.split()[0])
+	return urls
+
+def parseCssUrls(text):
+	urls = [match.group(2).strip() for match in CSS_URL.finditer(text)]
+	urls += [match.group(2).strip() for match in CSS_IMPORT.finditer(text)]
+	return [url for url in urls if url and not url.startswith("data:")]
+
+# The streaming parser sees one tag at a time. extractResources applies the same rules to the
+# attributes of a whole tree at once, so both find exactly the same things
+def resourcesFromElement(tag, attrs):
+	found = []
+	for name, value in attrs:
+		if value is None:
+			continue
+		name = name.lower()
+
+		if name in URL_ATTRS:
+			kind = URL_ATTRS[name]
+			if name == "href" and tag == "link":
+				rel = dict(attrs).get("rel") or ""
+				if any(i in PRELOAD_RELS for i in rel.lower().split()):
+					kind = "preload"
+			found.append(Resource(value, kind, name))
+		elif name in SRCSET_ATTRS:
+			for url in parseSrcset(value):
+				found.append(Resource(url, "srcset", name))
+		elif name == "style":
+			for url in parseCssUrls(value):
+				found.append(Resource(url, "style", name))
+	return found
+
+# Every attribute plus the text of <style> elements, in document order. Filtering the attribute
+# names in python is cheaper than an xpath predicate, and returning strings instead of elements
+# saves lxml.html from building an element proxy for every node in the page
+ALL_ATTRS = etree.XPath("descendant-or-self::*/@* | descendant-or-self::style/text()")
+PRELOAD_LINKS = etree.XPath("descendant-or-self::link[@rel and @href]")
+
+# Walks an already parsed lxml tree (e.g. parsel's Selector.root) once
+def extractResources(root):
+	preloads = set()
+	for link in PRELOAD_LINKS(root):
+		if any(i in PRELOAD_RELS for i in link.get("rel").lower().split()):
+			preloads.add(link.get("href"))
+
+	found = []
+	for value in ALL_ATTRS(root):
+		name = value.attrname
+		if name is None: # <style> text
+			for url in parseCssUrls(value):
+				found.append(Resource(url, "css", None))
+		elif name in URL_ATTRS:
+			kind = URL_ATTRS[name]
+			if name == "href" and value in preloads and value.getparent().tag == "link":
+				kind = "preload"
+			found.append(Resource(str(value), kind, name))
+		elif name in SRCSET_ATTRS:
+			for url in parseSrcset(value):
+				found.append(Resource(url, "srcset", name))
+		elif name == "style":
+			for url in parseCssUrls(value):
+				found.append(Resource(url, "style", name))
+	return found
+
+class StreamingExtractor(HTMLParser):
+	def __init__(self):
+		super(StreamingExtractor, self).__init__(convert_charrefs=True)
+		self.found = []
+		self.inStyle = False
+		self.styleText = []
+
+	def handle_starttag(self, tag, attrs):
+		if len(attrs) > 0:
+			self.found += resourcesFromElement(tag, attrs)
+		if tag == "style":
+			self.inStyle = True
+			self.styleText = []
+
+	def handle_startendtag(self, tag, attrs):
+		if len(attrs) > 0:
+			self.found += resourcesFromElement(tag, attrs)
+
+	def handle_data(self, data):
+		if self.inStyle:
+			self.styleText.append(data)
+
+	def handle_endtag(self, tag):
+		if tag == "style" and self.inStyle:
+			for url in parseCssUrls("".join(self.styleText)):
+				self.found.append(Resource(url, "css", None))
+			self.inStyle = False
+			self.styleText = []
+
+	def take(self):
+		found = self.found
+		self.found = []
+		return found
+
+# Extracts resources from a file-like object chunk by chunk without building a tree,
+# so memory stays flat no matter how big the document is. Yields resources as they're found
+def streamResources(fileobj, chunkSize=1024*1024):
+	parser = StreamingExtractor()
+	while True:
+		chunk = fileobj.read(chunkSize)
+		if not chunk:
+			break
+		parser.feed(chunk)
+		yield from parser.take()
+	parser.close()
+	yield from parser.take()
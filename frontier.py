@@ -0,0 +1,172 @@
+import os
+import heapq
+import logging
+import tempfile
+from collections import deque, namedtuple
+from urllib.parse import urlparse
+
+FrontierEntry = namedtuple("FrontierEntry", ["url", "depth"])
+
+CRAWL_ORDERS = ("bfs", "dfs", "priority")
+
+# Queue of links still to be crawled. Only (url, depth) pairs are kept here, never responses,
+# so memory use is bounded by the queue size instead of the crawl depth
+class CrawlFrontier():
+	def __init__(self, order="dfs", depthLimit=None, domainDepthLimits=None, memoryLimit=None):
+		if order not in CRAWL_ORDERS:
+			raise ValueError("Unknown crawl order '"+str(order)+"', expected one of "+", ".join(CRAWL_ORDERS))
+
+		self.order = order
+		self.depthLimit = depthLimit
+		self.domainDepthLimits = domainDepthLimits or {}
+		self.memoryLimit = memoryLimit # Max entries held in memory before spilling to disk
+
+		self.queue = [] if order == "priority" else deque()
+		self.counter = 0 # Tie breaker so priority order stays stable
+
+		self.spillFile = None
+		self.spillReadPos = 0
+		self.spillChunks = [] # (offset, count) of each chunk spilled in dfs mode, used as a stack
+		self.spilled = 0
+
+		self.pushedCount = 0
+		self.droppedCount = 0
+
+	@classmethod
+	def from_config(cls, config):
+		return cls(
+			order=config.get("crawlOrder", "dfs"),
+			depthLimit=config.get("depthLimit"),
+			domainDepthLimits=config.get("domainDepthLimits"),
+			memoryLimit=config.get("frontierMemoryLimit")
+		)
+
+	def __len__(self):
+		return len(self.queue)+self.spilled
+
+	def depth_limit_for(self, url):
+		host = urlparse(url).netloc.split(":")[0].lower()
+
+		# Most specific (longest) matching domain wins
+		best = None
+		for domain, limit in self.domainDepthLimits.items():
+			domain = domain.lower()
+			if host == domain or host.endswith("."+domain):
+				if best is None or len(domain) > len(best[0]):
+					best = (domain, limit)
+
+		if best is not None:
+			return best[1]
+		return self.depthLimit
+
+	def push(self, url, depth):
+		limit = self.depth_limit_for(url)
+		if limit is not None and depth > limit:
+			logging.debug("FRONTIER: depth limit %d reached for %s", limit, url)
+			self.droppedCount += 1
+			return False
+
+		self.pushedCount += 1
+		if self.memoryLimit is None:
+			self._push_memory(url, depth)
+		elif self.order == "dfs":
+			if len(self.queue) >= self.memoryLimit:
+				self._spill_stack_bottom()
+			self._push_memory(url, depth)
+		elif len(self.queue) >= self.memoryLimit or (self.order == "bfs" and self.spilled > 0):
+			self._spill(url, depth) # FIFO order has to go through the spill file once it's in use
+		else:
+			self._push_memory(url, depth)
+		return True
+
+	# Pushes links in page order; in dfs mode that means the first link is crawled first.
+	# Returns the urls that were actually queued
+	def extend(self, urls, depth):
+		if self.order == "dfs":
+			urls = reversed(urls)
+
+		added = []
+		for url in urls:
+			if self.push(url, depth):
+				added.append(url)
+		return added
+
+	def pop(self):
+		if len(self.queue) == 0 and self.spilled > 0:
+			self._unspill()
+
+		if len(self.queue) == 0:
+			raise IndexError("pop from empty frontier")
+
+		if self.order == "priority":
+			return heapq.heappop(self.queue)[2]
+		elif self.order == "bfs":
+			return self.queue.popleft()
+		else:
+			return self.queue.pop()
+
+	def close(self):
+		if self.spillFile is not None:
+			self.spillFile.close()
+			self.spillFile = None
+		self.spilled = 0
+
+	def _push_memory(self, url, depth):
+		entry = FrontierEntry(url, depth)
+		if self.order == "priority":
+			# Shallow pages first, then pages closer to the site root
+			self.counter += 1
+			heapq.heappush(self.queue, ((depth, url.count("/")), self.counter, entry))
+		else:
+			self.queue.append(entry)
+
+	def _open_spill(self):
+		if self.spillFile is None:
+			self.spillFile = tempfile.TemporaryFile("w+", encoding="utf8")
+			self.spillReadPos = 0
+		self.spillFile.seek(0, os.SEEK_END)
+
+	def _spill(self, url, depth):
+		self._open_spill()
+		self.spillFile.write(str(depth)+"\t"+url+"\n")
+		self.spilled += 1
+
+	# Moves the oldest half of the dfs stack to disk as one chunk; chunks come back newest first
+	def _spill_stack_bottom(self):
+		self._open_spill()
+		offset = self.spillFile.tell()
+		count = max(1, len(self.queue)//2)
+		for _ in range(count):
+			entry = self.queue.popleft()
+			self.spillFile.write(str(entry.depth)+"\t"+entry.url+"\n")
+		self.spillChunks.append((offset, count))
+		self.spilled += count
+
+	def _unspill(self):
+		if self.order == "dfs":
+			offset, count = self.spillChunks.pop()
+			self.spillFile.seek(offset)
+			for _ in range(count):
+				depth, url = self.spillFile.readline().rstrip("\n").split("\t", 1)
+				self._push_memory(url, int(depth))
+			self.spilled -= count
+			# Chunks are only ever read from the end, so the file can shrink with them
+			self.spillFile.seek(offset)
+			self.spillFile.truncate()
+			return
+
+		# Refill half the memory budget from disk, leaving room for newly discovered links
+		self.spillFile.seek(self.spillReadPos)
+		for _ in range(max(1, self.memoryLimit//2)):
+			line = self.spillFile.readline()
+			if not line:
+				break
+			depth, url = line.rstrip("\n").split("\t", 1)
+			self._push_memory(url, int(depth))
+			self.spilled -= 1
+		self.spillReadPos = self.spillFile.tell()
+
+		if self.spilled == 0: # Fully drained, start the file over
+			self.spillFile.seek(0)
+			self.spillFile.truncate()
+			self.spillReadPos = 0
@@ -0,0 +1,128 @@
+import os
+import logging
+import threading
+
+from pathUtils import is_pathname_valid
+
+COMPONENT_CACHE_SIZE = 100000
+
+# Remembers which archive directories already exist and which paths were already validated, so
+# saving a page or media file doesn't re-check every folder above it. Everything that goes through
+# here is counted, so the filesystem overhead of a crawl can be compared before and after changes.
+# Directories removed from outside (e.g. removeEmptyFolders) have to be forgotten with forget()
+class FsCache():
+	def __init__(self):
+		self.lock = threading.Lock() # Download workers create folders too
+		self.dirs = set() # Directories known to exist
+		self.writable = {} # Directory -> whether files can be created in it
+		self.validParts = set() # Path components the OS accepts as names
+		self.onCreate = None # Called with every folder created, e.g. to track it in the temp manifest
+		self.counters = {
+			"mkdir": 0,
+			"stat": 0,
+			"lstat": 0,
+			"access": 0,
+			"remove": 0,
+			"dirHits": 0,
+			"pathHits": 0
+		}
+
+	# Creates base/subdirs[0]/subdirs[1]/... where it doesn't exist yet and returns the full path.
+	# A file in the way of a folder is removed, a page can turn out to also be a folder of pages
+	def ensure_dir(self, base, subdirs):
+		direc = os.path.join(base, *[i.split(":")[0] for i in subdirs])
+		with self.lock:
+			if direc in self.dirs:
+				self.counters["dirHits"] += 1
+				return direc
+
+			missing = []
+			parent = direc
+			while parent not in self.dirs and len(parent) > len(base):
+				missing.append(parent)
+				parent = os.path.dirname(parent)
+
+			for path in reversed(missing):
+				self._make_dir(path)
+		return direc
+
+	# Same answer as pathUtils.is_path_exists_or_creatable, from cache where possible
+	def path_ok(self, pathname):
+		try:
+			with self.lock:
+				if not self._pathname_valid(pathname):
+					return False
+
+				dirname = os.path.dirname(pathname) or os.getcwd()
+				if dirname in self.dirs:
+					self.counters["pathHits"] += 1
+					return True
+				writable = self.writable.get(dirname)
+				if writable is None:
+					self.counters["access"] += 1
+					writable = os.access(dirname, os.W_OK)
+					if writable: # Not remembered otherwise, it may be created later
+						self.writable[dirname] = True
+				else:
+					self.counters["pathHits"] += 1
+				if writable:
+					return True
+				self.counters["stat"] += 1
+			return os.path.exists(pathname)
+		except OSError:
+			return False
+
+	# Drops a directory from the cache after it was removed from disk, or everything if no path
+	# is given. Folders can only be removed once empty, so their subfolders were forgotten first
+	def forget(self, path=None):
+		with self.lock:
+			if path is None:
+				self.dirs.clear()
+				self.writable.clear()
+			else:
+				self.dirs.discard(path)
+				self.writable.pop(path, None)
+
+	def stats(self):
+		with self.lock:
+			stats = dict(self.counters)
+		stats["syscalls"] = stats["mkdir"]+stats["stat"]+stats["lstat"]+stats["access"]+stats["remove"]
+		return stats
+
+	def _make_dir(self, path):
+		self.counters["mkdir"] += 1
+		try:
+			os.mkdir(path)
+			logging.debug("SUBDIR CREATE: "+path)
+			created = True
+		except FileExistsError:
+			self.counters["stat"] += 1
+			created = not os.path.isdir(path)
+			if created: # Uhoh it's a file
+				logging.debug("DELFILE FOR SUBDIR: "+path)
+				self.counters["remove"] += 1
+				self.counters["mkdir"] += 1
+				os.remove(path)
+				os.mkdir(path)
+		self.dirs.add(path)
+		if created and self.onCreate is not None:
+			self.onCreate(path)
+
+	def _pathname_valid(self, pathname):
+		if not isinstance(pathname, str) or not pathname:
+			return False
+
+		_, pathname = os.path.splitdrive(pathname)
+		for part in pathname.split(os.sep):
+			if not part or part in self.validParts:
+				continue
+			self.counters["lstat"] += 1
+			if not is_pathname_valid(part):
+				return False
+			if len(self.validParts) >= COMPONENT_CACHE_SIZE:
+				self.validParts.clear()
+			self.validParts.add(part)
+		return True
+
+# Shared by everything in this process
+fsCache = FsCache()
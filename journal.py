@@ -0,0 +1,153 @@
+import os
+import json
+import logging
+import threading
+
+JOURNAL_NAME = "journal.jsonl"
+
+# Append-only log of crawl progress, so an interrupted crawl can pick up where it stopped.
+# Each line is one record:
+#   {"op": "seen", "url": ...}                   link added to the seen index (in-memory index only)
+#   {"op": "queue", "url": ..., "depth": ...}    page pushed onto the frontier
+#   {"op": "done", "url": ...}                   page parsed, its links and media are queued
+#   {"op": "media", "url": ..., "path": ...}     media download queued
+#   {"op": "saved", "path": ...}                 media download finished (or failed for good)
+#   {"op": "complete"}                           crawl finished, nothing to resume
+# The redirect map and on-disk seen indexes persist themselves, so they aren't journaled
+class CrawlJournal():
+	def __init__(self, path, resume=True, compactEvery=50000, logSeen=True):
+		self.path = path
+		self.compactEvery = compactEvery
+		self.logSeen = logSeen
+		self.lock = threading.Lock() # Downloads finish on worker threads
+
+		self.seen = []
+		self.pendingPages = {} # url -> depth, queued but not parsed yet
+		self.pendingMedia = {} # path -> url, queued but not downloaded yet
+		self.doneCount = 0
+		self.sinceCompact = 0
+
+		self.resuming = resume and self._load()
+		if not self.resuming:
+			self.seen = []
+			self.pendingPages = {}
+			self.pendingMedia = {}
+			self.doneCount = 0
+
+		self.file = open(self.path, "a" if self.resuming else "w", encoding="utf8")
+
+	@classmethod
+	def from_config(cls, config, stateDir, logSeen=True):
+		return cls(
+			os.path.join(stateDir, JOURNAL_NAME),
+			resume=config.get("resume", True),
+			compactEvery=config.get("journalCompactEvery", 50000),
+			logSeen=logSeen
+		)
+
+	# Hands back what's left to do from the journal being resumed, as (seen, pages, media)
+	def resume_state(self):
+		seen = self.seen
+		self.seen = []
+		with self.lock:
+			return seen, list(self.pendingPages.items()), list((url, path) for path, url in self.pendingMedia.items())
+
+	def seen_url(self, url):
+		if self.logSeen:
+			self._write({"op": "seen", "url": url})
+
+	def queued_page(self, url, depth):
+		with self.lock:
+			self.pendingPages[url] = depth
+		self._write({"op": "queue", "url": url, "depth": depth})
+
+	def done_page(self, url):
+		with self.lock:
+			self.pendingPages.pop(url, None)
+			self.doneCount += 1
+		self._write({"op": "done", "url": url}, flush=True)
+
+	def queued_media(self, url, path):
+		with self.lock:
+			self.pendingMedia[path] = url
+		self._write({"op": "media", "url": url, "path": path})
+
+	def saved_media(self, path):
+		with self.lock:
+			self.pendingMedia.pop(path, None)
+		self._write({"op": "saved", "path": path})
+
+	def complete(self):
+		self._write({"op": "complete"}, flush=True)
+
+	# Rewrites the journal as a snapshot of what's still needed. seenUrls is None when the
+	# seen index keeps itself on disk
+	def compact(self, seenUrls):
+		with self.lock:
+			tempPath = self.path+".compact"
+			with open(tempPath, "w", encoding="utf8") as f:
+				if self.logSeen and seenUrls is not None:
+					for url in seenUrls:
+						f.write(json.dumps({"op": "seen", "url": url})+"\n")
+				f.write(json.dumps({"op": "stats", "done": self.doneCount})+"\n")
+				for url, depth in self.pendingPages.items():
+					f.write(json.dumps({"op": "queue", "url": url, "depth": depth})+"\n")
+				for path, url in self.pendingMedia.items():
+					f.write(json.dumps({"op": "media", "url": url, "path": path})+"\n")
+
+			self.file.close()
+			os.replace(tempPath, self.path)
+			self.file = open(self.path, "a", encoding="utf8")
+			self.sinceCompact = 0
+		logging.debug("JOURNAL: compacted, %d page(s) and %d download(s) pending", len(self.pendingPages), len(self.pendingMedia))
+
+	def needs_compaction(self):
+		return self.compactEvery is not None and self.sinceCompact >= self.compactEvery
+
+	def close(self):
+		with self.lock:
+			if self.file is not None:
+				self.file.flush()
+				self.file.close()
+				self.file = None
+
+	def _write(self, record, flush=False):
+		with self.lock:
+			if self.file is None:
+				return
+			self.file.write(json.dumps(record)+"\n")
+			self.sinceCompact += 1
+			if flush:
+				self.file.flush()
+
+	# Replays an existing journal, returns False if there's nothing to resume
+	def _load(self):
+		if not os.path.isfile(self.path):
+			return False
+
+		complete = False
+		with open(self.path, "r", encoding="utf8") as f:
+			for line in f:
+				try:
+					record = json.loads(line)
+				except ValueError:
+					break # Torn last line from a crash, everything before it is still good
+
+				op = record["op"]
+				if op == "seen":
+					self.seen.append(record["url"])
+				elif op == "queue":
+					self.pendingPages[record["url"]] = record["depth"]
+				elif op == "done":
+					self.pendingPages.pop(record["url"], None)
+					self.doneCount += 1
+				elif op == "media":
+					self.pendingMedia[record["path"]] = record["url"]
+				elif op == "saved":
+					self.pendingMedia.pop(record["path"], None)
+				elif op == "stats":
+					self.doneCount = record["done"]
+				elif op == "complete":
+					complete = True
+
+		return not complete and (len(self.pendingPages) > 0 or len(self.pendingMedia) > 0)
@@ -0,0 +1,98 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+PageMeta = namedtuple("PageMeta", ["url", "etag", "lastModified", "contentHash", "fetched"])
+
+def contentHash(data):
+	if isinstance(data, str):
+		data = data.encode("utf8", errors="ignore")
+	return hashlib.sha256(data).hexdigest()
+
+# What we knew about every page and media file the last time it was fetched, so incremental
+# recrawls can ask the server whether anything changed instead of fetching it all again.
+# Shared by the crawler and worker threads, so every access goes through the lock
+class PageMetaStore():
+	def __init__(self, path, poolSize=4, commitEvery=500):
+		self.session = requests.Session() # For page probes from render workers
+		adapter = HTTPAdapter(pool_connections=16, pool_maxsize=poolSize)
+		self.session.mount("http://", adapter)
+		self.session.mount("https://", adapter)
+
+		self.lock = threading.Lock()
+		self.db = sqlite3.connect(path, check_same_thread=False)
+		self.db.execute("PRAGMA journal_mode=WAL")
+		self.db.execute("CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_hash TEXT, fetched REAL)")
+		self.commitEvery = commitEvery
+		self.pending = 0
+
+		self.unchanged = 0
+		self.changed = 0
+
+	@classmethod
+	def from_config(cls, config, stateDir):
+		return cls(os.path.join(stateDir, "pages.sqlite"), poolSize=config.get("renderConcurrency", 4))
+
+	def get(self, url):
+		with self.lock:
+			row = self.db.execute("SELECT url, etag, last_modified, content_hash, fetched FROM pages WHERE url=?", (url,)).fetchone()
+		return PageMeta(*row) if row is not None else None
+
+	# Fields left as None keep what was stored before
+	def update(self, url, etag=None, lastModified=None, contentHash=None):
+		with self.lock:
+			self.db.execute("""INSERT INTO pages (url, etag, last_modified, content_hash, fetched) VALUES (?, ?, ?, ?, ?)
+				ON CONFLICT(url) DO UPDATE SET
+					etag=COALESCE(excluded.etag, etag),
+					last_modified=COALESCE(excluded.last_modified, last_modified),
+					content_hash=COALESCE(excluded.content_hash, content_hash),
+					fetched=excluded.fetched""", (url, etag, lastModified, contentHash, time.time()))
+			self.pending += 1
+			if self.pending >= self.commitEvery:
+				self.db.commit()
+				self.pending = 0
+
+	def conditional_headers(self, meta):
+		headers = {}
+		if meta is not None and meta.etag:
+			headers["If-None-Match"] = meta.etag
+		if meta is not None and meta.lastModified:
+			headers["If-Modified-Since"] = meta.lastModified
+		return headers
+
+	# Asks the server whether a url we have a local copy of changed since it was fetched.
+	# Returns (changed, etag, lastModified). A url we have no metadata for keeps its local copy
+	# and the answer's headers become the baseline for the next run
+	def probe(self, url, session=None, timeout=12):
+		session = session or self.session
+		meta = self.get(url)
+		headers = self.conditional_headers(meta)
+		with session.get(url, headers=headers, stream=True, timeout=timeout) as r: # Body isn't read, just the status and validators
+			etag = r.headers.get("ETag")
+			lastModified = r.headers.get("Last-Modified")
+			# Without validators to send, a 200 can't tell us anything, so the page counts as changed
+			changed = r.status_code == 200 and meta is not None
+
+		if meta is None or not changed: # Changed urls are updated once the new copy is stored
+			self.update(url, etag, lastModified)
+		if meta is not None:
+			with self.lock:
+				if changed:
+					self.changed += 1
+				else:
+					self.unchanged += 1
+		return changed, etag, lastModified
+
+	def close(self):
+		self.session.close()
+		with self.lock:
+			if self.db is not None:
+				self.db.commit()
+				self.db.close()
+				self.db = None
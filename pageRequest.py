@@ -1,52 +1,75 @@
 import requests
 from parsel import Selector
 
-class SplashRequest():
-	def __init__(self, url, adArr, strictDomains, **kw):
+from parseUtils import isPageContentType
+
+# Common parts of a fetched page. The parsed tree is only built when something asks for it,
+# so very large pages can be streamed instead
+class PageResponse():
+	_selector = None
+
+	@property
+	def selector(self):
+		if self._selector is None:
+			self._selector = Selector(text=self.body or "")
+		return self._selector
+
+	@property
+	def root(self):
+		return self.selector.root
+
+	def css(self, query):
+		return self.selector.css(query)
+
+	def xpath(self, query):
+		return self.selector.xpath(query)
+
+class SplashRequest(PageResponse):
+	def __init__(self, url, adArr, strictDomains, splash=None, **kw):
+		params = {
+			'url': url,
+			'wait': 0.25, 
+			'html5_media': 1,
+			'html': 1,
+			'resource_timeout': 2,
+			'timeout': 12
+		}
 		if str(strictDomains) == "True" or str(strictDomains) == "true":
 			if len(adArr) == 0:
-				allowedDomains = "*"
+				params['allowed_domains'] = "*"
 			elif len(adArr) == 1:
-				allowedDomains = adArr
+				params['allowed_domains'] = adArr
 			else:
-				allowedDomains = ",".join(adArr)
-
-			r = requests.get('http://localhost:8050/render.html', params={
-				'url': url,
-				'wait': 0.25, 
-				'html5_media': 1,
-				'html': 1,
-				'resource_timeout': 2,
-				'allowed_domains': allowedDomains,
-				'timeout': 12
-			})
+				params['allowed_domains'] = ",".join(adArr)
+
+		# A SplashPool spreads renders over several Splash instances
+		if splash is not None:
+			r = splash.render(params)
 		else:
-			r = requests.get('http://localhost:8050/render.html', params={
-				'url': url,
-				'wait': 0.25, 
-				'html5_media': 1,
-				'html': 1,
-				'resource_timeout': 2,
-				'timeout': 12
-			})
+			r = requests.get('http://localhost:8050/render.html', params=params)
 		self.url = url
 		self.status = r.status_code
+		self.headers = r.headers # Retry-After when backing off
 		if (r.status_code == 200):
 			self.body = r.text
-			selector = Selector(text=self.body)
 		else:
 			self.body = None
-			selector = Selector(text="")
 
-		self.css = selector.css
-		self.xpath = selector.xpath
-
-class LocalRequest():
+class LocalRequest(PageResponse):
 	def __init__(self, url, filedata, **kw):
 		self.url = url
 		self.body = filedata
 		self.status = 200
 
-		selector = Selector(text=self.body)
-		self.css = selector.css
-		self.xpath = selector.xpath
+# Plain GET of a page that doesn't need rendering. Anything that isn't html gets no body, like a
+# failed render, so the crawler downloads it as media instead
+class DirectRequest(PageResponse):
+	def __init__(self, url, session=None, timeout=12, **kw):
+		r = (session or requests).get(url, timeout=timeout)
+		self.url = url
+		self.status = r.status_code
+		self.headers = r.headers # Retry-After when backing off
+		if r.status_code == 200 and isPageContentType(r.headers.get("Content-Type")):
+			self.body = r.text
+		else:
+			self.body = None
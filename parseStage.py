@@ -0,0 +1,80 @@
+import io
+import logging
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from parsel import Selector
+
+from urlClassifier import UrlClassifier
+import parseUtils
+import extractor
+
+# Everything the crawler needs from a parsed page: where it's stored, and every allowed link on it
+# split into pages and media. Small enough to send back from a worker process cheaply
+ParsedPage = namedtuple("ParsedPage", ["url", "filepath", "links", "media"])
+
+# Extracts, cleans and classifies the links of one page. Pure CPU work, so it can run anywhere
+def parseBody(config, url, body, classifier):
+	if len(body) > config.get("streamExtractBytes", 8*1024*1024):
+		found = extractor.streamResources(io.StringIO(body)) # Too big to build a whole tree for
+	else:
+		found = extractor.extractResources(Selector(text=body).root)
+
+	links = []
+	media = []
+	unique = set()
+	for resource in found:
+		link = parseUtils.cleanLink(parseUtils.forceAbsoluteLink(url, resource.url))
+		if not link or link in unique: # Filter "None" invalid links
+			continue
+		unique.add(link)
+
+		if not classifier.url_allowed(link):
+			logging.debug("GotLink nOK: "+link)
+		elif classifier.is_media(link):
+			media.append(link)
+		else:
+			links.append(link)
+
+	return ParsedPage(url, parseUtils.getUrlFilepath(config, url), links, media)
+
+# Set up once in every worker process
+workerConfig = None
+workerClassifier = None
+
+def initWorker(config):
+	global workerConfig, workerClassifier
+	workerConfig = config
+	workerClassifier = UrlClassifier.from_config(config)
+
+def parseInWorker(url, body):
+	return parseBody(workerConfig, url, body, workerClassifier)
+
+# Moves page parsing off the crawler's threads into a pool of processes, so parsing isn't
+# limited to one core by the GIL. Render workers hand their page over and wait for the result,
+# which lets parsing overlap with rendering and downloading
+class ParseStage():
+	def __init__(self, config, workers):
+		# Forked workers don't re-run the script that started the crawl (spawned ones do, unless
+		# it's guarded by if __name__ == "__main__"). They're all started straight away, before
+		# the crawler has any threads of its own
+		methods = multiprocessing.get_all_start_methods()
+		context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+		self.workers = max(1, workers)
+		self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=initWorker, initargs=(config,))
+		self.executor.submit(int).result()
+
+	@classmethod
+	def from_config(cls, config):
+		return cls(config, workers=config.get("parseWorkers", multiprocessing.cpu_count()))
+
+	# Blocks the calling thread until a worker process has parsed the page
+	def parse(self, url, body):
+		return self.executor.submit(parseInWorker, url, body).result()
+
+	def close(self):
+		self.executor.shutdown(wait=True)
+
+	def abort(self):
+		self.executor.shutdown(wait=False, cancel_futures=True)
@@ -2,6 +2,9 @@ import logging
 from urllib.parse import urlparse, urljoin
 import os
 
+from extensions import pageContentTypes
+from fsCache import fsCache
+
 cwd = os.path.dirname(os.path.realpath(__file__))
 
 def extractURLParts(url):
@@ -31,6 +34,27 @@ def extractURLParts(url):
 			})
 
 
+# Where the local copy of a page is stored in the archive
+def getUrlFilepath(config, url):
+	parts = extractURLParts(url)
+	return os.path.join(cwd, config["folderName"], *parts["fullPath"], parts["page"])
+
+# Folder for crawl bookkeeping (indexes, journals), kept next to the archive rather than inside it
+def getStateDir(config):
+	direc = os.path.join(cwd, config.get("stateFolderName", config["folderName"]+".state"))
+	if not os.path.isdir(direc):
+		os.mkdir(direc)
+	return direc
+
+# Decides from HEAD response headers whether a link is a page to render or media to download.
+# Links without a content type are treated as pages unless they're too big to be one
+def isPageContentType(contentType, contentLength=None, maxPageBytes=None):
+	if contentType is None or contentType.strip() == "":
+		return maxPageBytes is None or contentLength is None or contentLength <= maxPageBytes
+
+	mimeType = contentType.split(";")[0].strip().lower()
+	return mimeType in pageContentTypes
+
 def cleanLink(url):
 	parsed = urlparse(url.strip())
 	if parsed.scheme is None or parsed.scheme == "":
@@ -42,24 +66,15 @@ def cleanLink(url):
 		urlClean = urljoin(parsed.scheme+"://"+parsed.netloc, parsed.path)
 	return urlClean
 
+# Makes sure base/subdirs... exists, folders already created this run aren't checked again
 def createSubdirs(base, subdirs):
 	if len(subdirs) != 0:
-		for idx in range(0, len(subdirs)):
-			subdirs[idx] = subdirs[idx].split(":")[0]
+		fsCache.ensure_dir(base, subdirs)
 
-		for idx in range(0, len(subdirs)):
-			direc = os.path.join(base, *subdirs[:(idx+1)])
-			if os.path.exists(direc) and not os.path.isdir(direc): # Uhoh it's a file
-				logging.debug("DELFILE FOR SUBDIR: "+direc)
-				os.remove(direc)
 
-			if not os.path.isdir(direc):
-				logging.debug("SUBDIR CREATE: "+direc)
-				os.mkdir(direc)
-
-
-# Takes a list of links and returns urls and filepaths for them
-def extractMedia(config, baseURL, mediaURLS):
+# Takes a list of links and returns urls and filepaths for them, creating their folders unless
+# subdirs is False
+def extractMedia(config, baseURL, mediaURLS, subdirs=True):
 	extractedURLS = []
 	extractedPaths = []
 
@@ -69,11 +84,13 @@ def extractMedia(config, baseURL, mediaURLS):
 		if parts["subdir"] == "":
 			mediaURL = urljoin(baseURL,mediaURL)
 			# Relative path, so refer to inside URLparts directory
-			createSubdirs(os.path.join(cwd, config["folderName"]), URLparts["fullPath"]+parts["fullPath"])
+			if subdirs:
+				createSubdirs(os.path.join(cwd, config["folderName"]), URLparts["fullPath"]+parts["fullPath"])
 			mediaPath = os.path.join(cwd, config["folderName"], *(URLparts["fullPath"]+parts["fullPath"]), parts["page"])
 		else:
 			# Absolute path
-			createSubdirs(os.path.join(cwd, config["folderName"]), parts["fullPath"])
+			if subdirs:
+				createSubdirs(os.path.join(cwd, config["folderName"]), parts["fullPath"])
 			mediaPath = os.path.join(cwd, config["folderName"], *parts["fullPath"], parts["page"])
 
 		extractedURLS.append(mediaURL)
@@ -98,43 +115,45 @@ def forceAbsoluteLink(baseURL, linkURL):
 		# Absolute path
 		return linkURL
 
-def removeEmptyFolders(path):
-	count = 0
-	if not os.path.isdir(path):
-		return 0
-
-	# remove empty subfolders
-	files = os.listdir(path)
-	if len(files):
-		for f in files:
-			fullpath = os.path.join(path, f)
-			if os.path.isdir(fullpath):
-				count += removeEmptyFolders(fullpath)
-
-	# if folder empty, delete it
-	files = os.listdir(path)
-	if len(files) == 0:
+# One os.scandir pass over the archive, for when there's no temp manifest to go by. Removes
+# leftover .temp files and/or folders left empty (the folder itself included), returns how many
+# of each were removed as (temps, folders)
+def sweepArchive(path, temps=True, folders=True):
+	temps, folders, _ = _sweep(path, temps, folders)
+	return temps, folders
+
+def _sweep(path, removeTemps, removeFolders):
+	tempCount = 0
+	folderCount = 0
+	remaining = 0
+	try:
+		with os.scandir(path) as entries:
+			for entry in entries:
+				if entry.is_dir(follow_symlinks=False):
+					temps, folders, removed = _sweep(entry.path, removeTemps, removeFolders)
+					tempCount += temps
+					folderCount += folders
+					if not removed:
+						remaining += 1
+				elif removeTemps and entry.name.endswith(".temp"):
+					logging.debug("Removing temp file: "+entry.path)
+					os.remove(entry.path)
+					tempCount += 1
+				else:
+					remaining += 1
+	except FileNotFoundError:
+		return 0, 0, False
+
+	# Every entry was seen above, so there's no need to list the folder again
+	if removeFolders and remaining == 0:
 		logging.debug("Removing empty folder: "+path)
 		os.rmdir(path)
-		count+=1
+		fsCache.forget(path)
+		return tempCount, folderCount+1, True
+	return tempCount, folderCount, False
 
-	return count
+def removeEmptyFolders(path):
+	return sweepArchive(path, temps=False)[1]
 
 def removeTempFiles(path):
-	count = 0
-	if not os.path.isdir(path):
-		return 0
-
-	# recurse to subfolders
-	files = os.listdir(path)
-	if len(files):
-		for f in files:
-			fullpath = os.path.join(path, f)
-			if os.path.isdir(fullpath):
-				count += removeTempFiles(fullpath)
-			elif os.path.isfile(fullpath) and ".temp" in fullpath:
-				logging.debug("Removing temp file: "+fullpath)
-				count+=1
-				os.remove(fullpath)
-
-	return count
\ No newline at end of file
+	return sweepArchive(path, folders=False)[0]
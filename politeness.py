@@ -0,0 +1,214 @@
+import time
+import heapq
+import logging
+import threading
+from collections import namedtuple
+from urllib.robotparser import RobotFileParser
+
+import requests
+
+from urlClassifier import splitHostPath
+
+# Answers meaning "not now" rather than "not ever", worth slowing down for and trying again
+RETRY_STATUSES = (429, 502, 503, 504)
+
+def retryAfterSeconds(headers):
+	value = headers.get("Retry-After") if headers is not None else None
+	if value is not None and value.strip().isdigit():
+		return int(value.strip())
+	return None # HTTP dates aren't worth parsing, the backoff covers them
+
+class HostState():
+	def __init__(self, rate, burst):
+		self.lock = threading.Lock()
+		self.rate = rate # Requests per second, None for no limit
+		self.burst = burst
+		self.tokens = float(burst)
+		self.refilled = time.monotonic()
+		self.nextFree = 0.0 # No request before this, spaces out requests while backing off
+		self.penalty = 0.0 # Extra seconds between requests, grows on 429/503 and slow answers
+		self.latency = None
+		self.robotsChecked = False
+
+# Per host rate limiting shared by every thread that sends requests. Each host gets a token bucket
+# of hostRate requests per second (a robots.txt Crawl-delay lowers it), and backs off on its own when
+# it answers 429/503 or slows down, easing off again as it recovers. Call wait() before a request
+# and observe() with how it went
+class Politeness():
+	def __init__(self, rate=None, hostRates=None, burst=1, respectRobots=True, baseDelay=1.0, maxDelay=60.0, slowSeconds=5.0, userAgent="*"):
+		self.rate = rate
+		self.hostRates = {host.lower(): hostRate for host, hostRate in (hostRates or {}).items()}
+		self.burst = max(1, burst)
+		self.respectRobots = respectRobots
+		self.baseDelay = baseDelay
+		self.maxDelay = maxDelay
+		self.slowSeconds = slowSeconds
+		self.userAgent = userAgent
+		self.lock = threading.Lock()
+		self.hosts = {}
+
+		self.waited = 0.0
+		self.backoffs = 0
+
+	@classmethod
+	def from_config(cls, config):
+		return cls(
+			rate=config.get("hostRate"),
+			hostRates=config.get("hostRates"),
+			burst=config.get("hostBurst", 1),
+			respectRobots=config.get("respectCrawlDelay", True),
+			baseDelay=config.get("backoffBaseDelay", 1.0),
+			maxDelay=config.get("backoffMaxDelay", 60.0),
+			slowSeconds=config.get("slowResponseSeconds", 5.0)
+		)
+
+	# Blocks until a request to url's host is allowed
+	def wait(self, url):
+		host = self.host_state(url)
+		with host.lock:
+			now = time.monotonic()
+			delay = max(0.0, host.nextFree-now)
+			if host.rate is not None:
+				host.tokens = min(host.burst, host.tokens+(now-host.refilled)*host.rate)
+				host.refilled = now
+				host.tokens -= 1 # Going below zero reserves a later slot for this request
+				if host.tokens < 0:
+					delay = max(delay, -host.tokens/host.rate)
+			host.nextFree = max(now, host.nextFree)+host.penalty
+
+		if delay > 0:
+			with self.lock:
+				self.waited += delay
+			time.sleep(delay)
+
+	# Adapts the host's pace to how a request went. status is None when it failed outright
+	def observe(self, url, status, seconds=None, headers=None):
+		host = self.host_state(url)
+		with host.lock:
+			if seconds is not None:
+				host.latency = seconds if host.latency is None else host.latency*0.8+seconds*0.2
+
+			if status is None or status in RETRY_STATUSES:
+				host.penalty = min(self.maxDelay, max(self.baseDelay, host.penalty*2))
+				pause = retryAfterSeconds(headers)
+				host.nextFree = max(host.nextFree, time.monotonic()+(pause if pause is not None else host.penalty))
+				logging.debug("POLITENESS: backing off "+splitHostPath(url)[0]+" to %.2fs between requests (%s)", host.penalty, status)
+				with self.lock:
+					self.backoffs += 1
+			elif self.slowSeconds is not None and host.latency is not None and host.latency > self.slowSeconds:
+				host.penalty = min(self.maxDelay, max(self.baseDelay, host.penalty*1.5))
+			elif host.penalty > 0:
+				host.penalty = host.penalty*0.8 if host.penalty > 0.01 else 0.0
+
+	def host_state(self, url):
+		name = splitHostPath(url)[0].lower()
+		with self.lock:
+			host = self.hosts.get(name)
+			if host is None:
+				host = HostState(self.hostRates.get(name.split(":")[0], self.rate), self.burst)
+				self.hosts[name] = host
+
+		if self.respectRobots and not host.robotsChecked:
+			with host.lock: # Other requests to the host wait for robots.txt
+				if not host.robotsChecked:
+					self._apply_robots(url, host)
+					host.robotsChecked = True
+		return host
+
+	def stats(self):
+		with self.lock:
+			return {
+				"hosts": len(self.hosts),
+				"waited": self.waited,
+				"backoffs": self.backoffs,
+				"slowedHosts": sum(1 for host in self.hosts.values() if host.penalty > 0)
+			}
+
+	def _apply_robots(self, url, host):
+		scheme = url.split("://", 1)[0] if "://" in url else "http"
+		robotsUrl = scheme+"://"+splitHostPath(url)[0]+"/robots.txt"
+		try:
+			r = requests.get(robotsUrl, timeout=10)
+			if r.status_code != 200:
+				return
+			parser = RobotFileParser()
+			parser.parse(r.text.splitlines())
+		except Exception as e:
+			logging.debug("POLITENESS: couldn't read "+robotsUrl+": "+str(e))
+			return
+
+		delay = parser.crawl_delay(self.userAgent)
+		requestRate = parser.request_rate(self.userAgent)
+		robotsRate = None
+		if delay:
+			robotsRate = 1.0/float(delay)
+		if requestRate is not None and requestRate.requests > 0:
+			robotsRate = min(robotsRate or float("inf"), requestRate.requests/float(requestRate.seconds))
+		if robotsRate is not None and (host.rate is None or robotsRate < host.rate):
+			logging.info("Following robots.txt of %s: at most %.2f request(s) per second", splitHostPath(url)[0], robotsRate)
+			host.rate = robotsRate
+			host.burst = 1
+			host.tokens = min(host.tokens, 1.0)
+
+RetryItem = namedtuple("RetryItem", ["due", "kind", "url", "extra", "attempt"])
+
+# Fetches that failed for a reason that may go away, held until they're due to be tried again.
+# Each retry waits twice as long as the one before. Items are keyed by kind and url, so the
+# same fetch is never queued twice
+class RetryQueue():
+	def __init__(self, maxRetries=3, baseDelay=5.0):
+		self.maxRetries = maxRetries
+		self.baseDelay = baseDelay
+		self.lock = threading.Lock() # Media retries are scheduled from download workers
+		self.heap = []
+		self.attempts = {} # (kind, url) -> retries so far
+		self.queued = set()
+		self.retried = 0
+		self.gaveUp = 0
+
+	@classmethod
+	def from_config(cls, config):
+		return cls(maxRetries=config.get("maxRetries", 3), baseDelay=config.get("retryDelay", 5.0))
+
+	def __len__(self):
+		with self.lock:
+			return len(self.heap)
+
+	# Returns False once the fetch has used up its retries
+	def schedule(self, kind, url, extra=None, delay=None):
+		key = (kind, url)
+		with self.lock:
+			if key in self.queued:
+				return True
+			attempt = self.attempts.get(key, 0)+1
+			if attempt > self.maxRetries:
+				self.gaveUp += 1
+				return False
+			self.attempts[key] = attempt
+			self.queued.add(key)
+			due = time.monotonic()+max(delay or 0, self.baseDelay*2**(attempt-1)) # delay is a Retry-After from the server
+			heapq.heappush(self.heap, RetryItem(due, kind, url, extra, attempt))
+		return True
+
+	def is_queued(self, kind, url):
+		with self.lock:
+			return (kind, url) in self.queued
+
+	# Every item that's due, oldest first
+	def due(self):
+		items = []
+		now = time.monotonic()
+		with self.lock:
+			while len(self.heap) > 0 and self.heap[0].due <= now:
+				item = heapq.heappop(self.heap)
+				self.queued.discard((item.kind, item.url))
+				items.append(item)
+			self.retried += len(items)
+		return items
+
+	# Seconds until the next item is due, None if there's nothing queued
+	def wait_time(self):
+		with self.lock:
+			if len(self.heap) == 0:
+				return None
+			return max(0.0, self.heap[0].due-time.monotonic())
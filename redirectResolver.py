@@ -0,0 +1,120 @@
+import time
+import sqlite3
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from politeness import RETRY_STATUSES
+
+RedirectRecord = namedtuple("RedirectRecord", ["url", "final", "status", "fetched", "contentType", "contentLength", "error"])
+
+COLUMNS = "url, final, status, fetched, content_type, content_length"
+
+# Resolves where links end up after redirects. HEAD requests are sent concurrently in batches and
+# every answer is kept in a persistent redirect map, so repeated links and reruns skip the network
+class RedirectResolver():
+	def __init__(self, path, workers=8, batchSize=64, maxAge=None, timeout=12, politeness=None):
+		self.workers = max(1, workers)
+		self.batchSize = max(1, batchSize)
+		self.maxAge = maxAge # Seconds before a stored redirect is looked up again, None keeps them forever
+		self.timeout = timeout
+		self.politeness = politeness # Per host rate limits shared with the rest of the crawl
+
+		self.db = sqlite3.connect(path)
+		self.db.execute("PRAGMA journal_mode=WAL")
+		self.db.execute("CREATE TABLE IF NOT EXISTS redirects (url TEXT PRIMARY KEY, final TEXT, status INTEGER, fetched REAL, content_type TEXT, content_length INTEGER)")
+		# Redirect maps from older runs don't have the header columns yet
+		columns = [row[1] for row in self.db.execute("PRAGMA table_info(redirects)")]
+		if "content_type" not in columns:
+			self.db.execute("ALTER TABLE redirects ADD COLUMN content_type TEXT")
+			self.db.execute("ALTER TABLE redirects ADD COLUMN content_length INTEGER")
+
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=16, pool_maxsize=self.workers)
+		self.session.mount("http://", adapter)
+		self.session.mount("https://", adapter)
+		self.executor = ThreadPoolExecutor(max_workers=self.workers)
+
+		self.hits = 0
+		self.misses = 0
+
+	@classmethod
+	def from_config(cls, config, path, politeness=None):
+		return cls(
+			path,
+			workers=config.get("redirectWorkers", 8),
+			batchSize=config.get("redirectBatchSize", 64),
+			maxAge=config.get("redirectCacheMaxAge"),
+			politeness=politeness
+		)
+
+	# Returns a RedirectRecord for every url, in the same order
+	def resolve(self, urls):
+		records = []
+		for idx in range(0, len(urls), self.batchSize):
+			records += self._resolve_batch(urls[idx:idx+self.batchSize])
+		return records
+
+	def lookup(self, url):
+		row = self.db.execute("SELECT "+COLUMNS+" FROM redirects WHERE url=?", (url,)).fetchone()
+		if row is None or not self._fresh(row[3]):
+			return None
+		return RedirectRecord(*row, None)
+
+	def close(self):
+		self.executor.shutdown(wait=True)
+		self.session.close()
+		if self.db is not None:
+			self.db.commit()
+			self.db.close()
+			self.db = None
+
+	def _fresh(self, fetched):
+		return self.maxAge is None or time.time()-fetched <= self.maxAge
+
+	def _resolve_batch(self, urls):
+		known = {}
+		placeholders = ",".join("?" for _ in urls)
+		for row in self.db.execute("SELECT "+COLUMNS+" FROM redirects WHERE url IN ("+placeholders+")", urls):
+			if self._fresh(row[3]):
+				known[row[0]] = RedirectRecord(*row, None)
+
+		missing = [url for url in dict.fromkeys(urls) if url not in known]
+		self.hits += len(urls)-len(missing)
+		self.misses += len(missing)
+
+		if len(missing) > 0:
+			logging.debug("REDIRECTS: resolving %d link(s), %d already known", len(missing), len(urls)-len(missing))
+			rows = []
+			for record in self.executor.map(self._head, missing):
+				known[record.url] = record
+				if record.error is None and record.status not in RETRY_STATUSES: # Only remember real answers
+					rows.append(record[:-1])
+			self.db.executemany("INSERT OR REPLACE INTO redirects ("+COLUMNS+") VALUES (?, ?, ?, ?, ?, ?)", rows)
+			self.db.commit()
+
+		return [known[url] for url in urls]
+
+	# Runs on a worker thread
+	def _head(self, url):
+		if self.politeness is not None:
+			self.politeness.wait(url)
+		start = time.perf_counter()
+		try:
+			with self.session.head(url, allow_redirects=True, timeout=self.timeout) as followedLink: # Don't get the content, just redirect and type headers
+				if self.politeness is not None:
+					self.politeness.observe(url, followedLink.status_code, time.perf_counter()-start, followedLink.headers)
+				contentLength = followedLink.headers.get("Content-Length")
+				return RedirectRecord(
+					url, followedLink.url, followedLink.status_code, time.time(),
+					followedLink.headers.get("Content-Type"),
+					int(contentLength) if contentLength is not None and contentLength.isdigit() else None,
+					None
+				)
+		except Exception as e:
+			if self.politeness is not None:
+				self.politeness.observe(url, None, time.perf_counter()-start)
+			return RedirectRecord(url, None, None, time.time(), None, None, e)
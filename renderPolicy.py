@@ -0,0 +1,129 @@
+import os
+import re
+import json
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from urlClassifier import DomainTrie, splitHostPath
+
+RENDER_MODES = ("adaptive", "always", "never")
+POLICY_NAME = "renderPolicy.json"
+
+SCRIPT_TAG = re.compile(r"<script\b", re.IGNORECASE)
+LINK_TAG = re.compile(r"<a\s[^>]*href", re.IGNORECASE)
+# Empty mount points and "turn on javascript" notices left by client side rendered apps
+SPA_MARKERS = re.compile(r"""<div[^>]+id=["'](?:root|app|__next|__nuxt)["'][^>]*>\s*</div>|<noscript>[^<]{0,200}javascript|\bng-app\b|data-reactroot""", re.IGNORECASE)
+DIGITS = re.compile(r"\d")
+
+# Url pattern decisions are remembered under: host plus the folders of the path, with anything
+# containing a digit (ids, dates, page numbers) generalized, e.g. example.com/blog/*/
+def urlPattern(link):
+	host, path = splitHostPath(link)
+	segments = [i for i in path.split("/") if i]
+	if not path.endswith("/"):
+		segments = segments[:-1] # The page itself
+	return host.lower()+"/"+"".join(("*" if DIGITS.search(i) else i)+"/" for i in segments)
+
+# Decides whether a page needs Splash to render it, or whether a plain GET of its html has all
+# its links already. Splash is many times more expensive, so in adaptive mode pages are fetched
+# directly first and only rendered when they look like they build their content with scripts.
+# Once a url pattern needed rendering, its other pages go straight to Splash
+class RenderPolicy():
+	def __init__(self, mode="adaptive", splashRules=(), directRules=(), minLinks=3, maxScripts=5, path=None, poolSize=4):
+		if mode not in RENDER_MODES:
+			raise ValueError("Unknown renderMode '"+str(mode)+"', expected one of "+", ".join(RENDER_MODES))
+
+		self.mode = mode
+		self.splashRules = DomainTrie(splashRules)
+		self.directRules = DomainTrie(directRules)
+		self.minLinks = minLinks
+		self.maxScripts = maxScripts
+		self.path = path
+		self.lock = threading.Lock() # Decisions are made on render worker threads
+
+		self.patterns = {} # Url pattern -> "splash" or "direct"
+		if path is not None and os.path.isfile(path):
+			with open(path, "r", encoding="utf8") as f:
+				self.patterns = json.load(f)
+
+		self.session = requests.Session() # For direct fetches
+		adapter = HTTPAdapter(pool_connections=16, pool_maxsize=poolSize)
+		self.session.mount("http://", adapter)
+		self.session.mount("https://", adapter)
+
+		self.direct = 0 # Pages that didn't need a render
+		self.escalated = 0 # Pages fetched directly that turned out to need one
+		self.rendered = 0 # Pages sent straight to Splash
+
+	@classmethod
+	def from_config(cls, config, stateDir):
+		rules = config.get("renderRules", {})
+		return cls(
+			mode=config.get("renderMode", "adaptive"),
+			splashRules=rules.get("splash", []),
+			directRules=rules.get("direct", []),
+			minLinks=config.get("renderMinLinks", 3),
+			maxScripts=config.get("renderMaxScripts", 5),
+			path=os.path.join(stateDir, POLICY_NAME),
+			poolSize=config.get("renderConcurrency", 4)
+		)
+
+	# "splash" or "direct", how a page should be fetched first
+	def decide(self, link):
+		host, path = splitHostPath(link)
+		host = host.split(":")[0].lower()
+		if self.splashRules.matches(host, path):
+			decision = "splash"
+		elif self.directRules.matches(host, path) or self.mode == "never":
+			decision = "direct"
+		elif self.mode == "always":
+			decision = "splash"
+		else:
+			with self.lock:
+				decision = self.patterns.get(urlPattern(link), "direct")
+
+		if decision == "splash":
+			with self.lock:
+				self.rendered += 1
+		return decision
+
+	# Looks at a directly fetched page and returns True if it should be rendered by Splash after
+	# all. Only adaptive mode escalates, and the answer is remembered for the page's url pattern
+	def needs_render(self, link, body):
+		host, path = splitHostPath(link)
+		if self.mode != "adaptive" or self.directRules.matches(host.split(":")[0].lower(), path):
+			needed = False
+		else:
+			needed = SPA_MARKERS.search(body) is not None
+			if not needed and len(LINK_TAG.findall(body)) < self.minLinks:
+				needed = len(SCRIPT_TAG.findall(body)) > self.maxScripts
+
+		with self.lock:
+			if needed:
+				self.escalated += 1
+				self.patterns[urlPattern(link)] = "splash"
+				logging.debug("RENDER POLICY: "+link+" needs rendering, so does "+urlPattern(link))
+			else:
+				self.direct += 1
+				self.patterns.setdefault(urlPattern(link), "direct")
+		return needed
+
+	def stats(self):
+		with self.lock:
+			return {
+				"escalated": self.escalated,
+				"rendered": self.rendered,
+				"rendersAvoided": self.direct,
+				"patterns": len(self.patterns)
+			}
+
+	def close(self):
+		self.session.close()
+		if self.path is not None:
+			with self.lock:
+				with open(self.path+".tmp", "w", encoding="utf8") as f:
+					json.dump(self.patterns, f)
+				os.replace(self.path+".tmp", self.path)
@@ -0,0 +1,88 @@
+import logging
+from collections import deque, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+
+RenderResult = namedtuple("RenderResult", ["url", "depth", "response", "error"])
+
+# Runs page renders on a thread pool so several pages are in flight at once. Results are handed
+# back to the caller's thread as they finish, so crawler state is only ever touched from one thread
+class RenderPool():
+	def __init__(self, render, concurrency=4, perHostLimit=None):
+		self.render = render # Called as render(url, depth) on a worker thread, returns a response
+		self.concurrency = max(1, concurrency)
+		self.perHostLimit = perHostLimit
+
+		self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+		self.running = {} # future -> (url, depth, host)
+		self.waiting = deque() # (url, depth, host) held back by the per host limit
+		self.hostCounts = defaultdict(int)
+
+	@classmethod
+	def from_config(cls, config, render):
+		return cls(
+			render,
+			concurrency=config.get("renderConcurrency", 4),
+			perHostLimit=config.get("renderPerHostLimit")
+		)
+
+	def __len__(self):
+		return len(self.running)+len(self.waiting)
+
+	# Allow a small backlog past the worker count so a busy host doesn't leave workers idle
+	def has_capacity(self):
+		return len(self) < self.concurrency*2
+
+	def submit(self, url, depth):
+		host = urlparse(url).netloc.lower()
+		self.waiting.append((url, depth, host))
+		self._dispatch()
+
+	# Blocks until at least one render finishes and returns every finished one
+	def completed(self, timeout=None):
+		if len(self.running) == 0:
+			self._dispatch()
+			if len(self.running) == 0:
+				return []
+
+		done, _ = wait(list(self.running), timeout=timeout, return_when=FIRST_COMPLETED)
+		results = []
+		for future in done:
+			url, depth, host = self.running.pop(future)
+			self.hostCounts[host] -= 1
+			if self.hostCounts[host] == 0:
+				del self.hostCounts[host]
+
+			try:
+				results.append(RenderResult(url, depth, future.result(), None))
+			except Exception as e:
+				results.append(RenderResult(url, depth, None, e))
+
+		self._dispatch()
+		return results
+
+	def close(self):
+		self.waiting.clear()
+		self.executor.shutdown(wait=True)
+
+	# Drops everything not started yet, for when the crawl is interrupted
+	def abort(self):
+		self.waiting.clear()
+		self.executor.shutdown(wait=False, cancel_futures=True)
+
+	def _dispatch(self):
+		# Start waiting renders in order, skipping over hosts that are at their limit
+		held = deque()
+		while len(self.waiting) > 0 and len(self.running) < self.concurrency:
+			url, depth, host = self.waiting.popleft()
+			if self.perHostLimit is not None and self.hostCounts[host] >= self.perHostLimit:
+				held.append((url, depth, host))
+				continue
+
+			self.hostCounts[host] += 1
+			future = self.executor.submit(self.render, url, depth)
+			self.running[future] = (url, depth, host)
+			logging.debug("RENDER: started "+url+" ("+str(len(self.running))+" in flight)")
+
+		held.extend(self.waiting)
+		self.waiting = held
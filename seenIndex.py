@@ -0,0 +1,142 @@
+import os
+import math
+import mmap
+import sqlite3
+import hashlib
+
+SEEN_INDEX_BACKENDS = ("memory", "sqlite", "bloom")
+
+# All seen indexes share the same interface: add() returns True if the url wasn't seen before
+
+class MemorySeenIndex():
+	def __init__(self):
+		self.urls = set()
+
+	def add(self, url):
+		if url in self.urls:
+			return False
+		self.urls.add(url)
+		return True
+
+	def __contains__(self, url):
+		return url in self.urls
+
+	def __iter__(self):
+		return iter(self.urls)
+
+	def __len__(self):
+		return len(self.urls)
+
+	def close(self):
+		pass
+
+# Exact index kept on disk, for crawls with more urls than fit in RAM
+class SQLiteSeenIndex():
+	def __init__(self, path, reset=True, commitEvery=1000):
+		if reset and os.path.exists(path):
+			os.remove(path)
+
+		self.db = sqlite3.connect(path)
+		self.db.execute("PRAGMA journal_mode=WAL")
+		self.db.execute("PRAGMA synchronous=OFF")
+		self.db.execute("CREATE TABLE IF NOT EXISTS seen (url TEXT PRIMARY KEY) WITHOUT ROWID")
+		self.commitEvery = commitEvery
+		self.pending = 0
+		self.count = self.db.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+
+	def add(self, url):
+		cur = self.db.execute("INSERT OR IGNORE INTO seen (url) VALUES (?)", (url,))
+		if cur.rowcount == 0:
+			return False
+
+		self.count += 1
+		self.pending += 1
+		if self.pending >= self.commitEvery:
+			self.db.commit()
+			self.pending = 0
+		return True
+
+	def __contains__(self, url):
+		return self.db.execute("SELECT 1 FROM seen WHERE url=?", (url,)).fetchone() is not None
+
+	def __iter__(self):
+		return (row[0] for row in self.db.execute("SELECT url FROM seen"))
+
+	def __len__(self):
+		return self.count
+
+	def close(self):
+		if self.db is not None:
+			self.db.commit()
+			self.db.close()
+			self.db = None
+
+# Fixed size memory mapped bloom filter. Uses a few bytes per url no matter how long it is,
+# at the cost of a small false positive rate (a new url is occasionally treated as seen)
+class BloomSeenIndex():
+	def __init__(self, path, capacity=10000000, errorRate=0.001, reset=True):
+		self.bits = max(8, int(-capacity*math.log(errorRate)/(math.log(2)**2)))
+		self.hashes = max(1, int(round(self.bits/capacity*math.log(2))))
+		size = (self.bits+7)//8
+
+		if reset and os.path.exists(path):
+			os.remove(path)
+
+		self.file = open(path, "a+b")
+		if os.path.getsize(path) != size:
+			self.file.truncate(size)
+		self.map = mmap.mmap(self.file.fileno(), size)
+		self.count = 0
+
+	def _positions(self, url):
+		# Double hashing, derive all k positions from one 128 bit digest
+		digest = hashlib.blake2b(url.encode("utf8", errors="ignore"), digest_size=16).digest()
+		h1 = int.from_bytes(digest[:8], "little")
+		h2 = int.from_bytes(digest[8:], "little") | 1
+		return [(h1+i*h2) % self.bits for i in range(self.hashes)]
+
+	def add(self, url):
+		new = False
+		for pos in self._positions(url):
+			byte = self.map[pos >> 3]
+			mask = 1 << (pos & 7)
+			if not byte & mask:
+				self.map[pos >> 3] = byte | mask
+				new = True
+
+		if new:
+			self.count += 1
+		return new
+
+	def __contains__(self, url):
+		for pos in self._positions(url):
+			if not self.map[pos >> 3] & (1 << (pos & 7)):
+				return False
+		return True
+
+	def __len__(self):
+		return self.count # Approximate, false positives are never counted
+
+	def close(self):
+		if self.map is not None:
+			self.map.flush()
+			self.map.close()
+			self.file.close()
+			self.map = None
+
+# On-disk indexes are wiped unless reset=False, which is used when resuming a crawl
+def makeSeenIndex(config, stateDir, reset=True):
+	backend = config.get("seenIndex", "memory")
+	if backend == "memory":
+		return MemorySeenIndex()
+	elif backend == "sqlite":
+		return SQLiteSeenIndex(config.get("seenIndexPath", os.path.join(stateDir, "seen.sqlite")), reset=reset)
+	elif backend == "bloom":
+		return BloomSeenIndex(
+			config.get("seenIndexPath", os.path.join(stateDir, "seen.bloom")),
+			capacity=config.get("bloomCapacity", 10000000),
+			errorRate=config.get("bloomErrorRate", 0.001),
+			reset=reset
+		)
+	else:
+		raise ValueError("Unknown seenIndex '"+str(backend)+"', expected one of "+", ".join(SEEN_INDEX_BACKENDS))
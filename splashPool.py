@@ -0,0 +1,173 @@
+import sys
+import time
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Statuses meaning the Splash instance itself is in trouble rather than the page
+SPLASH_FAILURE_STATUSES = (502, 503, 504)
+
+class SplashEndpoint():
+	def __init__(self, url):
+		self.url = url.rstrip("/")
+		self.outstanding = 0 # Renders in flight
+		self.latency = None # Moving average of render time in seconds
+		self.failures = 0 # Failures in a row
+		self.down = False # Taken out after too many failures in a row
+		self.nextCheck = 0.0 # When a down endpoint is pinged again
+		self.renders = 0
+		self.failed = 0
+
+# Spreads renders over several Splash instances. Each render goes to the healthy instance with
+# the fewest renders in flight; instances averaging more than slowSeconds a render are only used
+# when nothing else is healthy. An instance that fails maxFailures renders in a row is taken out
+# and pinged on /_ping every healthInterval seconds until it answers again. A render that
+# times out or hits a failing instance is retried on another one
+class SplashPool():
+	def __init__(self, endpoints, retries=2, timeout=30, healthInterval=30, maxFailures=3, slowSeconds=None, poolSize=4):
+		if len(endpoints) == 0:
+			raise ValueError("splashEndpoints needs at least one Splash url")
+
+		self.endpoints = [SplashEndpoint(url) for url in endpoints]
+		self.retries = retries
+		self.timeout = timeout
+		self.healthInterval = healthInterval
+		self.maxFailures = maxFailures
+		self.slowSeconds = slowSeconds
+		self.lock = threading.Lock() # Renders run on the render pool's threads
+
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=len(self.endpoints), pool_maxsize=poolSize)
+		self.session.mount("http://", adapter)
+		self.session.mount("https://", adapter)
+
+		self.retried = 0
+
+	@classmethod
+	def from_config(cls, config):
+		return cls(
+			config.get("splashEndpoints", ["http://localhost:8050"]),
+			retries=config.get("splashRetries", 2),
+			timeout=config.get("splashTimeout", 30),
+			healthInterval=config.get("splashHealthInterval", 30),
+			maxFailures=config.get("splashMaxFailures", 3),
+			slowSeconds=config.get("splashSlowSeconds"),
+			poolSize=config.get("renderConcurrency", 4)
+		)
+
+	# Renders through Splash's render.html endpoint and returns the requests response
+	def render(self, params):
+		tried = []
+		lastError = None
+		for attempt in range(self.retries+1):
+			if len(tried) == len(self.endpoints): # With fewer instances than retries, go round again
+				tried = []
+			endpoint = self._acquire(tried)
+			tried.append(endpoint)
+			if attempt > 0:
+				with self.lock:
+					self.retried += 1
+
+			start = time.perf_counter()
+			try:
+				r = self.session.get(endpoint.url+"/render.html", params=params, timeout=self.timeout)
+			except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+				self._release(endpoint, None, False)
+				logging.debug("SPLASH: "+endpoint.url+" failed rendering '"+str(params.get("url"))+"': "+str(e))
+				lastError = e
+				continue
+
+			if r.status_code in SPLASH_FAILURE_STATUSES:
+				self._release(endpoint, None, False)
+				logging.debug("SPLASH: "+endpoint.url+" answered "+str(r.status_code)+" rendering '"+str(params.get("url"))+"'")
+				lastError = requests.exceptions.HTTPError("Splash answered "+str(r.status_code), response=r)
+				continue
+
+			self._release(endpoint, time.perf_counter()-start, True)
+			return r
+		raise lastError
+
+	# Pings every endpoint, brings back the ones that answer and returns {url: healthy}
+	def check_health(self):
+		return {endpoint.url: self._ping(endpoint) for endpoint in self.endpoints}
+
+	def stats(self):
+		with self.lock:
+			return [{
+				"url": endpoint.url,
+				"renders": endpoint.renders,
+				"failed": endpoint.failed,
+				"latency": endpoint.latency,
+				"healthy": not endpoint.down
+			} for endpoint in self.endpoints]
+
+	def close(self):
+		self.session.close()
+
+	def _acquire(self, tried):
+		while True:
+			now = time.time()
+			with self.lock:
+				candidates = [i for i in self.endpoints if i not in tried]
+
+				# Down instances are pinged again once their time is up, by whoever gets there first
+				recheck = [i for i in candidates if i.down and i.nextCheck <= now]
+				for endpoint in recheck:
+					endpoint.nextCheck = now+self.healthInterval
+
+				if len(recheck) == 0:
+					up = [i for i in candidates if not i.down]
+					if len(up) > 0:
+						endpoint = min(up, key=lambda i: (self._is_slow(i), i.outstanding, i.latency or 0.0))
+					else:
+						# Everything is down, rather than stall the crawl try the one due to be checked first
+						endpoint = min(candidates, key=lambda i: i.nextCheck)
+					endpoint.outstanding += 1
+					return endpoint
+
+			for endpoint in recheck:
+				self._ping(endpoint)
+
+	def _release(self, endpoint, seconds, ok):
+		with self.lock:
+			endpoint.outstanding -= 1
+			if ok:
+				endpoint.renders += 1
+				endpoint.failures = 0
+				endpoint.latency = seconds if endpoint.latency is None else endpoint.latency*0.8+seconds*0.2
+			else:
+				endpoint.failed += 1
+				endpoint.failures += 1
+				if endpoint.failures >= self.maxFailures and not endpoint.down:
+					endpoint.down = True
+					endpoint.nextCheck = time.time()+self.healthInterval
+					logging.warning("Splash at "+endpoint.url+" failed "+str(endpoint.failures)+" render(s) in a row, taking it out until it answers /_ping")
+
+	def _is_slow(self, endpoint):
+		return self.slowSeconds is not None and endpoint.latency is not None and endpoint.latency > self.slowSeconds
+
+	def _ping(self, endpoint):
+		try:
+			ok = self.session.get(endpoint.url+"/_ping", timeout=5).status_code == 200
+		except requests.exceptions.RequestException:
+			ok = False
+
+		with self.lock:
+			if ok:
+				if endpoint.down:
+					logging.info("Splash at "+endpoint.url+" is answering again")
+				endpoint.down = False
+				endpoint.failures = 0
+			else:
+				endpoint.down = True
+				endpoint.nextCheck = time.time()+self.healthInterval
+		return ok
+
+# Checks which Splash instances are up: python splashPool.py http://localhost:8050 http://otherhost:8050
+if __name__ == "__main__":
+	pool = SplashPool(sys.argv[1:] or ["http://localhost:8050"])
+	for url, healthy in pool.check_health().items():
+		print(url+"\t"+("up" if healthy else "down"))
+	pool.close()
@@ -0,0 +1,290 @@
+import io
+import os
+import re
+import sys
+import uuid
+import zlib
+import hashlib
+import sqlite3
+import logging
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+from fsCache import fsCache
+
+STORAGE_BACKENDS = ("files", "warc")
+
+# Where pages and media end up. Everything is addressed by the filepath the url maps to in the
+# archive, so the rest of the crawler doesn't care whether that's a real file or a record in a
+# WARC file. Media is written from download worker threads, pages from the crawl loop
+
+# One file per page or media file, written to a .temp file first and moved into place
+class FileStorage():
+	needsFolders = True
+
+	def __init__(self, tempFiles, contentStore=None):
+		self.tempFiles = tempFiles
+		self.contentStore = contentStore # Deduplicates media when set
+
+	def path_ok(self, filepath):
+		return fsCache.path_ok(filepath)
+
+	def has(self, filepath):
+		return os.path.isfile(filepath)
+
+	def read_page(self, filepath):
+		with open(filepath, 'r', encoding="utf8", errors="ignore") as file:
+			return file.read()
+
+	def write_page(self, url, filepath, body):
+		tempfilepath = filepath+".temp"
+		self.tempFiles.started(tempfilepath)
+		with open(tempfilepath, 'w', encoding="utf8", errors="ignore") as f:
+			f.write(body)
+		os.replace(tempfilepath, filepath) # Move finished file to final path
+		self.tempFiles.finished(tempfilepath)
+
+	# Streams chunks to the file, returns (bytes written, sha256 hex digest or None unless hashed)
+	def write_media(self, url, filepath, chunks, contentType=None, hashed=False):
+		tempfilepath = filepath+".temp"
+		written = 0
+		digest = hashlib.sha256() if hashed or self.contentStore is not None else None
+		self.tempFiles.started(tempfilepath)
+		with open(tempfilepath, 'wb') as f:
+			for chunk in chunks:
+				f.write(chunk)
+				written += len(chunk)
+				if digest is not None:
+					digest.update(chunk)
+
+		if self.contentStore is not None:
+			self.contentStore.store(tempfilepath, digest.hexdigest(), written, filepath)
+		else:
+			os.replace(tempfilepath, filepath) # Move finished file to final path
+		self.tempFiles.finished(tempfilepath)
+		return written, digest.hexdigest() if digest is not None else None
+
+	def close(self):
+		pass
+
+WARC_VERSION = "WARC/1.1"
+INDEX_NAME = "warcIndex.sqlite"
+
+# Sort friendly url key of the CDX format, e.g. "com,example)/path?q"
+def surtKey(url):
+	rest = url.split("://", 1)[-1]
+	host, slash, path = rest.partition("/")
+	host = host.lower().split(":")[0]
+	if host.startswith("www."):
+		host = host[4:]
+	return ",".join(reversed(host.split(".")))+")"+slash+path
+
+# Appends every page and media file as a gzip compressed record to rolling WARC files, so an
+# archive is a handful of big files instead of millions of small ones. Each record is its own
+# gzip member, so any record can be read back on its own from the offset kept in the index. The
+# index is a SQLite table by filepath; a CDX file for other WARC tools is written on close
+class WarcStorage():
+	needsFolders = False
+
+	def __init__(self, root, prefix="archive", maxFileBytes=1024**3, commitEvery=500, readOnly=False):
+		self.root = root
+		self.readOnly = readOnly # For looking at an archive another crawl may be writing to
+		self.prefix = prefix
+		self.maxFileBytes = maxFileBytes
+		self.commitEvery = commitEvery
+		self.pending = 0
+		self.lock = threading.Lock()
+		self.readers = {} # WARC file name -> file descriptor used for reads
+
+		if not os.path.isdir(root):
+			os.mkdir(root)
+		self.db = sqlite3.connect(os.path.join(root, INDEX_NAME), check_same_thread=False)
+		self.db.execute("PRAGMA journal_mode=WAL")
+		self.db.execute("""CREATE TABLE IF NOT EXISTS records (path TEXT PRIMARY KEY, url TEXT, file TEXT, offset INTEGER,
+			length INTEGER, mime TEXT, digest TEXT, timestamp TEXT)""")
+
+		self.file = None
+		self.fileName = None
+		if not readOnly:
+			self._open_latest()
+
+	@classmethod
+	def from_config(cls, config, root):
+		return cls(
+			root,
+			prefix=config.get("warcPrefix", "archive"),
+			maxFileBytes=config.get("warcMaxFileBytes", 1024**3)
+		)
+
+	def path_ok(self, filepath):
+		return True # Paths are only index keys
+
+	def has(self, filepath):
+		with self.lock:
+			return self.db.execute("SELECT 1 FROM records WHERE path=?", (filepath,)).fetchone() is not None
+
+	def read_page(self, filepath):
+		return self.read(filepath).decode("utf8", errors="ignore")
+
+	# Payload of the latest record stored for filepath
+	def read(self, filepath):
+		with self.lock:
+			row = self.db.execute("SELECT file, offset, length FROM records WHERE path=?", (filepath,)).fetchone()
+			if row is None:
+				raise FileNotFoundError("No WARC record for "+filepath)
+			fileName, offset, length = row
+			fd = self.readers.get(fileName)
+			if fd is None:
+				fd = os.open(os.path.join(self.root, fileName), os.O_RDONLY | getattr(os, "O_BINARY", 0))
+				self.readers[fileName] = fd
+
+		record = zlib.decompress(os.pread(fd, length, offset), wbits=31)
+		headers, _, payload = record.partition(b"\r\n\r\n")
+		size = int(re.search(rb"\r\nContent-Length: (\d+)", headers).group(1))
+		return payload[:size]
+
+	def write_page(self, url, filepath, body):
+		data = body.encode("utf8", errors="ignore")
+		self._append(url, filepath, "text/html; charset=utf-8", io.BytesIO(data), len(data), hashlib.sha256(data))
+
+	# Spools the download first, a record has to start with its length
+	def write_media(self, url, filepath, chunks, contentType=None, hashed=False):
+		digest = hashlib.sha256()
+		written = 0
+		with tempfile.SpooledTemporaryFile(max_size=8*1024*1024) as spool:
+			for chunk in chunks:
+				spool.write(chunk)
+				digest.update(chunk)
+				written += len(chunk)
+			spool.seek(0)
+			self._append(url, filepath, contentType or "application/octet-stream", spool, written, digest)
+		return written, digest.hexdigest()
+
+	# Writes the CDX index of everything stored so far, for replay tools
+	def write_cdx(self, path=None):
+		path = path or os.path.join(self.root, self.prefix+".cdx")
+		with self.lock:
+			rows = self.db.execute("SELECT url, timestamp, mime, digest, length, offset, file FROM records").fetchall()
+		rows.sort(key=lambda row: (surtKey(row[0]), row[1]))
+		with open(path+".temp", "w", encoding="utf8") as f:
+			f.write(" CDX N b a m s k r M S V g\n")
+			for url, timestamp, mime, digest, length, offset, fileName in rows:
+				f.write(" ".join([surtKey(url), timestamp, url, mime.split(";")[0], "200", digest, "-", "-", str(length), str(offset), fileName])+"\n")
+		os.replace(path+".temp", path)
+		return len(rows)
+
+	def close(self):
+		with self.lock:
+			if self.db is None:
+				return
+			if self.file is not None:
+				self.file.close()
+				self.file = None
+			for fd in self.readers.values():
+				os.close(fd)
+			self.readers = {}
+			self.db.commit()
+
+		if not self.readOnly:
+			count = self.write_cdx()
+			logging.info("WARC: %d record(s) indexed in %s", count, os.path.join(self.root, self.prefix+".cdx"))
+		with self.lock:
+			self.db.close()
+			self.db = None
+
+	def _append(self, url, filepath, contentType, payload, length, digest):
+		now = datetime.now(timezone.utc)
+		headers = "\r\n".join([
+			WARC_VERSION,
+			"WARC-Type: resource",
+			"WARC-Record-ID: <urn:uuid:"+str(uuid.uuid4())+">",
+			"WARC-Date: "+now.strftime("%Y-%m-%dT%H:%M:%SZ"),
+			"WARC-Target-URI: "+url,
+			"WARC-Payload-Digest: sha256:"+digest.hexdigest(),
+			"Content-Type: "+contentType,
+			"Content-Length: "+str(length)
+		])+"\r\n\r\n"
+
+		with self.lock:
+			if self.file.tell() >= self.maxFileBytes:
+				self._roll()
+
+			offset = self.file.tell()
+			self._write_member(headers.encode("utf8"), payload)
+			self.db.execute("INSERT OR REPLACE INTO records (path, url, file, offset, length, mime, digest, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+				(filepath, url, self.fileName, offset, self.file.tell()-offset, contentType, "sha256:"+digest.hexdigest(), now.strftime("%Y%m%d%H%M%S")))
+			self.pending += 1
+			if self.pending >= self.commitEvery:
+				self.db.commit()
+				self.pending = 0
+
+	# One gzip member per record
+	def _write_member(self, headers, payload):
+		compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+		self.file.write(compressor.compress(headers))
+		while True:
+			chunk = payload.read(1024*1024)
+			if not chunk:
+				break
+			self.file.write(compressor.compress(chunk))
+		self.file.write(compressor.compress(b"\r\n\r\n"))
+		self.file.write(compressor.flush())
+		self.file.flush() # Readers use their own file descriptors
+
+	def _warcinfo(self):
+		info = ("software: ArchiverCrawler\r\nformat: WARC File Format 1.1\r\n").encode("utf8")
+		headers = "\r\n".join([
+			WARC_VERSION,
+			"WARC-Type: warcinfo",
+			"WARC-Record-ID: <urn:uuid:"+str(uuid.uuid4())+">",
+			"WARC-Date: "+datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+			"WARC-Filename: "+self.fileName,
+			"Content-Type: application/warc-fields",
+			"Content-Length: "+str(len(info))
+		])+"\r\n\r\n"
+		self._write_member(headers.encode("utf8"), io.BytesIO(info))
+
+	def _roll(self):
+		index = 0
+		if self.file is not None:
+			self.file.close()
+			index = int(self.fileName[len(self.prefix)+1:].split(".")[0])+1
+		self.fileName = self.prefix+"-"+str(index).zfill(5)+".warc.gz"
+		self.file = open(os.path.join(self.root, self.fileName), "ab")
+		if self.file.tell() == 0:
+			self._warcinfo()
+		self.db.commit()
+
+	# Carries on appending to the newest WARC file. Anything after its last indexed record was
+	# written by a crawl that stopped before indexing it, and is cut off
+	def _open_latest(self):
+		pattern = re.compile(re.escape(self.prefix)+r"-(\d{5})\.warc\.gz$")
+		existing = sorted(i for i in os.listdir(self.root) if pattern.match(i))
+		if len(existing) == 0:
+			self._roll()
+			return
+
+		self.fileName = existing[-1]
+		end = self.db.execute("SELECT MAX(offset+length) FROM records WHERE file=?", (self.fileName,)).fetchone()[0]
+		path = os.path.join(self.root, self.fileName)
+		if end is not None and os.path.getsize(path) > end:
+			logging.warning("WARC: dropping %d unindexed byte(s) at the end of %s", os.path.getsize(path)-end, self.fileName)
+			os.truncate(path, end)
+		self.file = open(path, "ab")
+
+def makeStorage(config, root, tempFiles, contentStore=None):
+	backend = config.get("storage", "files")
+	if backend == "files":
+		return FileStorage(tempFiles, contentStore)
+	elif backend == "warc":
+		if contentStore is not None:
+			logging.warning("dedupeMedia only applies to file storage, WARC records are stored as downloaded")
+		return WarcStorage.from_config(config, root)
+	raise ValueError("Unknown storage '"+str(backend)+"', expected one of "+", ".join(STORAGE_BACKENDS))
+
+# Prints a stored page or media file to stdout: python storage.py <archiveFolder> <filepath>
+if __name__ == "__main__":
+	storage = WarcStorage(sys.argv[1], readOnly=True)
+	sys.stdout.buffer.write(storage.read(sys.argv[2]))
+	storage.close()
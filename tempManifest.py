@@ -0,0 +1,105 @@
+import os
+import logging
+import threading
+
+MANIFEST_NAME = "temp.manifest"
+
+# Keeps track of every .temp file being written and every folder created in the archive, so
+# cleaning up only touches those instead of walking the whole archive. Append-only, one record
+# per line, so it survives an interrupted crawl:
+#   t <path>    temp file about to be written
+#   f <path>    temp file moved into place or removed
+#   d <path>    folder created
+class TempManifest():
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.Lock() # Temp files are written from download worker threads
+		self.temps = set() # Temp files not finished yet
+		self.dirs = set() # Folders that might be left empty
+
+		# Without a manifest nothing is known about what's in the archive
+		self.tracked = os.path.isfile(path)
+		if self.tracked:
+			self._load()
+		self.file = open(path, "a", encoding="utf8")
+
+	@classmethod
+	def from_config(cls, config, stateDir):
+		return cls(os.path.join(stateDir, MANIFEST_NAME))
+
+	def started(self, tempPath):
+		with self.lock:
+			self.temps.add(tempPath)
+			self._write("t", tempPath)
+
+	def finished(self, tempPath):
+		with self.lock:
+			self.temps.discard(tempPath)
+			self._write("f", tempPath)
+
+	def created_dir(self, path):
+		with self.lock:
+			self.dirs.add(path)
+			self._write("d", path)
+
+	# Removes temp files that were never finished, e.g. by a crawl that was interrupted. Returns how many
+	def remove_temps(self):
+		count = 0
+		with self.lock:
+			for tempPath in self.temps:
+				try:
+					os.remove(tempPath)
+					logging.debug("Removing temp file: "+tempPath)
+					count += 1
+				except FileNotFoundError:
+					pass
+			self.temps.clear()
+		return count
+
+	# Removes the tracked folders that ended up empty, deepest first so emptied parents go too.
+	# Returns the removed folders
+	def remove_empty_dirs(self):
+		removed = []
+		with self.lock:
+			for path in sorted(self.dirs, key=lambda i: i.count(os.sep), reverse=True):
+				try:
+					os.rmdir(path) # Fails unless empty, so no need to list it first
+				except OSError:
+					continue
+				logging.debug("Removing empty folder: "+path)
+				removed.append(path)
+			self.dirs.clear()
+		return removed
+
+	# Starts over with an empty manifest, once everything in it was cleaned up
+	def reset(self):
+		with self.lock:
+			self.file.close()
+			self.file = open(self.path, "w", encoding="utf8")
+			self.temps.clear()
+			self.dirs.clear()
+			self.tracked = True
+
+	def close(self):
+		with self.lock:
+			if self.file is not None:
+				self.file.close()
+				self.file = None
+
+	def _write(self, op, path):
+		if self.file is not None:
+			self.file.write(op+" "+path+"\n")
+			self.file.flush()
+
+	def _load(self):
+		with open(self.path, "r", encoding="utf8") as f:
+			for line in f:
+				if not line.endswith("\n"): # Torn last record from an interrupted crawl
+					break
+				op, _, path = line[:-1].partition(" ")
+				if op == "t":
+					self.temps.add(path)
+				elif op == "f":
+					self.temps.discard(path)
+				elif op == "d":
+					self.dirs.add(path)
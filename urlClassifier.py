@@ -0,0 +1,154 @@
+from extensions import mediaExtensions
+
+HOST_CACHE_SIZE = 10000
+
+# Splits a link into (host, path) without the overhead of urlparse, this runs for every link found
+def splitHostPath(link):
+	link = link.strip()
+	start = link.find("://")
+	start = start+3 if start >= 0 else 0
+
+	end = len(link)
+	for sep in "?#":
+		idx = link.find(sep, start)
+		if idx >= 0 and idx < end:
+			end = idx
+
+	slash = link.find("/", start, end)
+	if slash < 0:
+		return link[start:end], ""
+	return link[start:slash], link[slash:end]
+
+# Trie of host[/path] rules. Hosts are stored label by label from the right, so a rule for
+# "example.com" covers "example.com" and every subdomain of it but not "notexample.com".
+# Paths are stored segment by segment, so "example.com/a" covers "/a" and "/a/b" but not "/ab"
+class DomainTrie():
+	def __init__(self, rules):
+		self.root = {}
+		self.pathsKey = object() # Sentinel key holding the path trie of rules ending at a host node
+		self.endKey = object()
+		self.hostCache = {}
+		for rule in rules:
+			self.add(rule)
+
+	def add(self, rule):
+		rule = rule.strip()
+		if "://" in rule:
+			rule = rule.split("://", 1)[1]
+		host, _, path = rule.partition("/")
+		host = host.split(":")[0].lower()
+
+		node = self.root
+		for label in reversed([i for i in host.split(".") if i]):
+			node = node.setdefault(label, {})
+
+		node = node.setdefault(self.pathsKey, {})
+		for segment in [i for i in path.split("/") if i]:
+			node = node.setdefault(segment, {})
+		node[self.endKey] = True
+		self.hostCache = {}
+
+	# Path tries of every rule whose host matches, most general first
+	def host_matches(self, host):
+		matches = self.hostCache.get(host)
+		if matches is not None:
+			return matches
+
+		matches = []
+		node = self.root
+		for label in reversed(host.split(".")):
+			node = node.get(label)
+			if node is None:
+				break
+			if self.pathsKey in node:
+				matches.append(node[self.pathsKey])
+
+		if len(self.hostCache) >= HOST_CACHE_SIZE:
+			self.hostCache.clear()
+		self.hostCache[host] = matches
+		return matches
+
+	def path_matches(self, pathTrie, segments):
+		node = pathTrie
+		if self.endKey in node:
+			return True
+		for segment in segments:
+			node = node.get(segment)
+			if node is None:
+				return False
+			if self.endKey in node:
+				return True
+		return False
+
+	def matches(self, host, path):
+		pathTries = self.host_matches(host)
+		if len(pathTries) == 0:
+			return False
+		if any(self.endKey in pathTrie for pathTrie in pathTries):
+			return True # Host wide rule, no need to look at the path
+
+		segments = [i for i in path.split("/") if i]
+		for pathTrie in pathTries:
+			if self.path_matches(pathTrie, segments):
+				return True
+		return False
+
+# Precompiled link checks, built once from the config and extensions.py
+class UrlClassifier():
+	def __init__(self, allowedDomains, blockedSubdomains, extensions=mediaExtensions):
+		self.allowed = DomainTrie(allowedDomains)
+		self.blocked = DomainTrie(blockedSubdomains)
+		self.hostDecisions = {}
+		self.extensions = frozenset(ext.lower().strip(".") for ext in extensions)
+		self.maxExtensionParts = max([ext.count(".")+1 for ext in self.extensions] or [1]) # e.g. 2 for "tar.gz"
+
+	@classmethod
+	def from_config(cls, config):
+		return cls(config["allowedDomains"], config["blockedSubdomains"])
+
+	def url_allowed(self, link):
+		if "@" in link: # Filter emails
+			return False
+
+		host, path = splitHostPath(link)
+		decision = self.hostDecisions.get(host)
+		if decision is None:
+			decision = self._host_decision(host)
+		if decision is True or decision is False:
+			return decision
+
+		# Path rules apply to this host, decision holds the path tries to check
+		allowedTries, blockedTries = decision
+		segments = [i for i in path.split("/") if i]
+		if allowedTries is not None and not any(self.allowed.path_matches(i, segments) for i in allowedTries):
+			return False
+		return not any(self.blocked.path_matches(i, segments) for i in blockedTries)
+
+	# Most hosts are allowed or blocked as a whole, so their answer only has to be worked out once
+	def _host_decision(self, rawHost):
+		host = rawHost.split(":")[0].lower()
+		allowedTries = self.allowed.host_matches(host)
+		blockedTries = self.blocked.host_matches(host)
+
+		if len(allowedTries) == 0 or any(self.blocked.endKey in i for i in blockedTries):
+			decision = False
+		else:
+			if any(self.allowed.endKey in i for i in allowedTries):
+				allowedTries = None # Allowed host wide, only the blocked paths matter
+			decision = True if allowedTries is None and len(blockedTries) == 0 else (allowedTries, blockedTries)
+
+		if len(self.hostDecisions) >= HOST_CACHE_SIZE:
+			self.hostDecisions.clear()
+		self.hostDecisions[rawHost] = decision
+		return decision
+
+	# Looks at the extension of the last path segment only, so ".z" can't match "file.zip"
+	# and hosts or directories with dots in them don't count
+	def is_media(self, link):
+		path = splitHostPath(link)[1]
+		page = path[path.rfind("/")+1:].lower()
+		parts = page.split(".")
+		for count in range(1, min(self.maxExtensionParts, len(parts)-1)+1):
+			if ".".join(parts[-count:]) in self.extensions:
+				return True
+		return False